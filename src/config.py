@@ -3,8 +3,9 @@
 """Global configuration for simple Password Manager.
 by Tobias Küster, 2018
 
-This file contains some variables for global configuration, such as some
-useful defaults etc.
+This file contains some functions for global configuration, such as the path
+of the configuration file; those depending on the user's home directory look
+it up only when called, not on import.
 """
 
 import json
@@ -13,9 +14,16 @@ import os
 from pwdmgr_model import Configuration
 
 
-USER_DIR = os.environ["HOME"]
-CONFIG_PATH = os.path.join(USER_DIR, ".config", "t-kuester")
-CONFIG_FILE = os.path.join(CONFIG_PATH, "pwdmgr.json")
+def user_dir() -> str:
+	return os.environ["HOME"]
+
+
+def config_path() -> str:
+	return os.path.join(user_dir(), ".config", "t-kuester")
+
+
+def config_file() -> str:
+	return os.path.join(config_path(), "pwdmgr.json")
 
 
 def load_config() -> Configuration:
@@ -23,12 +31,12 @@ def load_config() -> Configuration:
 	with that name exists, but can not be read.
 	"""
 	try:
-		with open(CONFIG_FILE, "r") as f:
+		with open(config_file(), "r") as f:
 			return Configuration(**json.load(f))
 	except FileNotFoundError:
 		config = create_config()
-		os.makedirs(CONFIG_PATH, exist_ok=True)
-		with open(CONFIG_FILE, "w") as f:
+		os.makedirs(config_path(), exist_ok=True)
+		with open(config_file(), "w") as f:
 			json.dump(dict(config.__dict__), f, indent=4)
 		return config
 
@@ -36,7 +44,7 @@ def load_config() -> Configuration:
 def create_config() -> Configuration:
 	"""Ask user for new configuration detail, esp. e-mail and password path.
 	"""
-	print(f"Creating new Configuration at {CONFIG_FILE}...")
+	print(f"Creating new Configuration at {config_file()}...")
 	mail = input("Enter e-mail identity to be used for encryption: ")
 	path = input("Enter path to passwords file: ")
 	return Configuration(mail, path)
@@ -5,48 +5,119 @@
 by Tobias Küster, 2019
 
 optional arguments:
-  -n, --num NUM  Number of characters
-  -l, --lower    Allow lowercase characters?
-  -u, --upper    Allow uppercase characters?
-  -d, --digit    Allow digit characters?
-  -p, --punct    Allow punctuation characters?
+  -n, --num NUM      Number of characters
+  -l, --lower        Allow lowercase characters?
+  -u, --upper        Allow uppercase characters?
+  -d, --digit        Allow digit characters?
+  -p, --punct        Allow punctuation characters?
+  -s, --specl CHARS  Specify other characters to allow?
+  -c, --count COUNT  Number of passwords to generate
+  -a, --all-groups   Require at least one character of each group?
 """
 
 import argparse
-import random
+import secrets
 import string
+from itertools import repeat
+from typing import Iterator
+
+# number of passwords generated from one block of random bytes
+CHUNK = 1024
 
 
 def generate(num=20, lower=True, upper=True, digit=True, punct=True, specl=None):
 	""" Generate a random password of given length with given character
-	groups.	Even if character group is selected, password is not guaranteed
-	to have one or more of each group.
+	groups. Each character is drawn uniformly from all the selected characters
+	combined, so groups with more characters are more likely; even if a group
+	is selected, the password is not guaranteed to contain one of it.
+	"""
+	return next(generate_bulk(1, num, lower, upper, digit, punct, specl))
+
+
+def generate_bulk(count, num=20, lower=True, upper=True, digit=True, punct=True,
+                  specl=None, all_groups=False) -> Iterator[str]:
+	""" Generate given number of random passwords of given length with given
+	character groups, optionally with at least one character of each group.
+	Random bytes are drawn in large blocks from the OS' secure random number
+	generator and mapped to characters with rejection sampling, i.e. bytes that
+	would make some characters more likely than others are dropped; alphabets
+	of more than 256 characters use two bytes per character.
 	"""
 	groups = [g for b, g in ((lower, string.ascii_lowercase),
 	                         (upper, string.ascii_uppercase),
 	                         (digit, string.digits),
 	                         (punct, string.punctuation),
 	                         (specl, specl)) if b]
-	return ''.join(random.choice(random.choice(groups)) for _ in range(num))
+	alphabet = "".join(dict.fromkeys("".join(groups)))
+	if not alphabet:
+		raise ValueError("No characters to choose from")
+	if len(alphabet) > 256 ** 2:
+		raise ValueError("Too many different characters to choose from")
+	if all_groups and num < len(groups):
+		raise ValueError("Password too short to contain all character groups")
+	to_chars = char_mapper(alphabet)
+	group_sets = [set(g) for g in groups]
+	width = 1 if len(alphabet) <= 256 else 2
+	# expected fraction of accepted bytes, for estimating the block size
+	accept = (256 ** width - 256 ** width % len(alphabet)) / 256 ** width
+
+	if num == 0:
+		yield from repeat("", max(count, 0))
+		return
+
+	while count > 0:
+		n = min(count, CHUNK)
+		chars = ""
+		while len(chars) < n * num:
+			missing = n * num - len(chars)
+			chars += to_chars(secrets.token_bytes(width * (int(missing / accept * 1.1) + 16)))
+		passwords = [chars[i:i+num] for i in range(0, n * num, num)]
+		if all_groups:
+			passwords = [p for p in passwords if all(not g.isdisjoint(p) for g in group_sets)]
+		count -= len(passwords)
+		yield from passwords
+
+
+def char_mapper(alphabet):
+	""" Create function mapping a block of random bytes to characters of the
+	alphabet, dropping bytes at or above the largest multiple of its length;
+	for alphabets of more than 256 characters, each pair of bytes is one number
+	"""
+	n = len(alphabet)
+	if n > 256:
+		limit = 256 ** 2 - 256 ** 2 % n
+		pairs = lambda block: memoryview(block[:len(block) // 2 * 2]).cast("H")
+		return lambda block: "".join(alphabet[v % n] for v in pairs(block) if v < limit)
+	limit = 256 - 256 % n
+	if alphabet.isascii():
+		# map all bytes at once, using translation table
+		table = bytes(ord(alphabet[b % n]) for b in range(limit)) + bytes(256 - limit)
+		rejected = bytes(range(limit, 256))
+		return lambda block: block.translate(table, rejected).decode("ascii")
+	return lambda block: "".join(alphabet[b % n] for b in block if b < limit)
 
 
 def main():
 	""" for use from command line
 	"""
 	parser = argparse.ArgumentParser(description="Simple Password Generator")
-	parser.add_argument("-n, --num", type=int, default=10, dest="num", help="Number of characters")
-	parser.add_argument("-l, --lower", action='store_true', dest="lower", help="Allow lowercase characters?")
-	parser.add_argument("-u, --upper", action='store_true', dest="upper", help="Allow uppercase characters?")
-	parser.add_argument("-d, --digit", action='store_true', dest="digit", help="Allow digit characters?")
-	parser.add_argument("-p, --punct", action='store_true', dest="punct", help="Allow punctuation characters?")
-	parser.add_argument("-s, --specl", type=str, default='', dest="specl", help="Specify other characters to allow?")
+	parser.add_argument("-n", "--num", type=int, default=10, dest="num", help="Number of characters")
+	parser.add_argument("-l", "--lower", action='store_true', dest="lower", help="Allow lowercase characters?")
+	parser.add_argument("-u", "--upper", action='store_true', dest="upper", help="Allow uppercase characters?")
+	parser.add_argument("-d", "--digit", action='store_true', dest="digit", help="Allow digit characters?")
+	parser.add_argument("-p", "--punct", action='store_true', dest="punct", help="Allow punctuation characters?")
+	parser.add_argument("-s", "--specl", type=str, default='', dest="specl", help="Specify other characters to allow?")
+	parser.add_argument("-c", "--count", type=int, default=1, dest="count", help="Number of passwords to generate")
+	parser.add_argument("-a", "--all-groups", action='store_true', dest="all_groups", help="Require at least one character of each group?")
 	args = parser.parse_args()
 
 	if not any((args.lower, args.upper, args.digit, args.punct, args.specl)):
 		print("Please specify character groups; see --help for details.")
 		exit(1)
 
-	print(generate(args.num, args.lower, args.upper, args.digit, args.punct, args.specl))
+	for pwd in generate_bulk(args.count, args.num, args.lower, args.upper, args.digit,
+	                         args.punct, args.specl, args.all_groups):
+		print(pwd)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+"""Unlock agent for simple Password Manager.
+
+Background process, similar to ssh-agent, that decrypts the passwords once and
+then answers queries from local clients over a UNIX socket only accessible to
+the user, so that each lookup does not have to start GPG again. Queries have
+the same format as in the batch mode of the command line interface (e.g.
+`get <label>`, one per line) and are answered with one line of JSON each;
+`lock` makes the agent forget the passwords until the next query.
+
+The agent tries to lock its memory so the passwords are not swapped out (this
+may require raising `ulimit -l`) and disables core dumps. After some time
+without queries, it drops the passwords; note that Python can not overwrite
+the actual strings, but they are freed and not kept in swap. Changes (via
+`set`) are written back to the password file in batches after a short delay.
+
+Start with `python3 pwdmgr_agent.py`; query with `pwdmgr_cli.py --agent ...`.
+"""
+
+import argparse
+import asyncio
+import ctypes
+import ctypes.util
+import gc
+import json
+import os
+import resource
+import signal
+import socket
+import stat
+import struct
+import tempfile
+import threading
+from typing import List
+
+import config
+import pwdmgr_core
+from pwdmgr_cli import Lookup, answer
+from pwdmgr_model import Configuration
+
+IDLE_TIMEOUT = 15 * 60  # seconds without query before passwords are dropped
+WRITE_DELAY = 5         # seconds to wait for more changes before saving
+MCL_CURRENT, MCL_FUTURE = 1, 2
+
+
+def default_socket() -> str:
+	"""Get path of the agent's socket in the user's runtime directory, or in a
+	private directory in the temp directory if there is none.
+	"""
+	runtime = os.environ.get("XDG_RUNTIME_DIR") or \
+	          private_dir(os.path.join(tempfile.gettempdir(), f"pwdmgr-{os.getuid()}"))
+	return os.path.join(runtime, "pwdmgr-agent.sock")
+
+
+def private_dir(path: str) -> str:
+	"""Create directory only accessible to the user, unless it exists, and
+	check that it is owned by the user and not accessible to others, so that
+	no other user can create it first and put their own socket in it.
+	"""
+	try:
+		os.mkdir(path, 0o700)
+	except FileExistsError:
+		pass
+	info = os.lstat(path)
+	if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or stat.S_IMODE(info.st_mode) != 0o700:
+		raise PermissionError(f"Not a private directory of the user (mode 0700): {path}")
+	return path
+
+
+def lock_memory() -> bool:
+	"""Disable core dumps and try to lock all current and future memory of
+	the process, so it is not swapped out; return whether that worked.
+	"""
+	resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+	try:
+		libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+		if libc.mlockall(MCL_CURRENT | MCL_FUTURE) == 0:
+			return True
+		print("Could not lock memory:", os.strerror(ctypes.get_errno()))
+	except (OSError, AttributeError) as e:
+		print("Could not lock memory:", e)
+	return False
+
+
+class Agent:
+	"""The agent, holding the decrypted passwords and serving the queries.
+	"""
+
+	def __init__(self, conf: Configuration, session=None, idle_timeout=IDLE_TIMEOUT,
+	             write_delay=WRITE_DELAY):
+		self.conf = conf
+		self.session = session or pwdmgr_core.get_session()
+		self.idle_timeout = idle_timeout
+		self.write_delay = write_delay
+		self.lookup = None
+		self.idle_timer = None
+		self.write_timer = None
+		self.lock = None
+		self.stopped = None
+
+	async def serve(self, path: str, ready: threading.Event = None):
+		"""Decrypt passwords and serve queries on given socket until stopped.
+		"""
+		loop = asyncio.get_running_loop()
+		self.lock = asyncio.Lock()
+		self.stopped = asyncio.Event()
+		os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+		if os.path.exists(path):
+			os.remove(path)
+		umask = os.umask(0o177)
+		try:
+			server = await asyncio.start_unix_server(self.handle, path)
+		finally:
+			os.umask(umask)
+		try:
+			for sig in (signal.SIGINT, signal.SIGTERM):
+				loop.add_signal_handler(sig, self.stopped.set)
+		except (RuntimeError, ValueError):
+			pass  # not in main thread, e.g. in benchmark
+		await self.get_lookup()
+		self.reset_idle_timer()
+		print(f"Agent listening on {path}")
+		if ready is not None:
+			ready.set()
+		async with server:
+			await self.stopped.wait()
+		await self.write_back()
+		os.remove(path)
+
+	def stop(self):
+		self.stopped.set()
+
+	async def handle(self, reader, writer):
+		"""Handle connection of a client, answering one query per line.
+		"""
+		if not is_same_user(writer.get_extra_info("socket")):
+			writer.close()
+			return
+		while line := await reader.readline():
+			response = await self.answer(line.decode("utf-8"))
+			writer.write(json.dumps(response).encode("utf-8") + b"\n")
+			await writer.drain()
+		writer.close()
+
+	async def answer(self, line: str) -> dict:
+		"""Answer query, decrypting the passwords first if needed.
+		"""
+		self.reset_idle_timer()
+		if line.strip() == "lock":
+			await self.wipe()
+			return {"query": "lock", "result": []}
+		async with self.lock:
+			lookup = await self.get_lookup()
+			response = answer(lookup, line)
+			if lookup.modified and self.write_timer is None:
+				self.write_timer = asyncio.get_running_loop().call_later(
+					self.write_delay, lambda: asyncio.ensure_future(self.write_back()))
+		return response
+
+	async def get_lookup(self) -> Lookup:
+		if self.lookup is None:
+			loop = asyncio.get_running_loop()
+			groups = await loop.run_in_executor(None, pwdmgr_core.load_vaults, self.conf, self.session)
+			self.lookup = Lookup.from_groups(groups)
+		return self.lookup
+
+	async def write_back(self):
+		"""Save passwords if they have been changed since the last save.
+		"""
+		self.write_timer = None
+		async with self.lock:
+			if self.lookup is not None and self.lookup.modified:
+				loop = asyncio.get_running_loop()
+				changes = self.lookup.get_changes()
+				groups = self.lookup.groups(len(self.conf.get_vaults()))
+				try:
+					await loop.run_in_executor(None, pwdmgr_core.save_vaults, self.conf,
+					                           groups, changes.keys(), self.session, changes)
+					self.lookup.changes = {}
+				except Exception as e:
+					print("Saving failed:", e)
+
+	async def wipe(self):
+		"""Save pending changes, then drop the decrypted passwords.
+		"""
+		if self.write_timer is not None:
+			self.write_timer.cancel()
+		await self.write_back()
+		if self.lookup is not None and not self.lookup.modified:
+			print("Dropping passwords")
+			self.lookup = None
+			gc.collect()
+
+	def reset_idle_timer(self):
+		if self.idle_timer is not None:
+			self.idle_timer.cancel()
+		self.idle_timer = asyncio.get_running_loop().call_later(
+			self.idle_timeout, lambda: asyncio.ensure_future(self.wipe()))
+
+
+def is_same_user(sock: socket.socket) -> bool:
+	"""Check that the peer of the socket is run by the same user, if the
+	platform supports it; otherwise, rely on the socket's permissions.
+	"""
+	try:
+		creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+	except (AttributeError, OSError):
+		return True
+	_pid, uid, _gid = struct.unpack("3i", creds)
+	return uid == os.getuid()
+
+
+class Client:
+	"""Client keeping a connection to the agent open for multiple queries.
+	"""
+
+	def __init__(self, path: str = None):
+		self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.sock.connect(path or default_socket())
+		self.file = self.sock.makefile("rwb")
+
+	def query(self, line: str) -> dict:
+		"""Send query to the agent and return its answer.
+		"""
+		self.file.write(line.strip().encode("utf-8") + b"\n")
+		self.file.flush()
+		return json.loads(self.file.readline())
+
+	def query_all(self, lines: List[str]) -> List[dict]:
+		return [self.query(line) for line in lines if line.strip()]
+
+	def close(self):
+		self.file.close()
+		self.sock.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *_args):
+		self.close()
+
+
+def test():
+	"""Just for testing the agent, running in a thread on a temporary socket
+	with a throwaway keyring, queried with the client, and checking that the
+	passwords are saved after a change and dropped after the idle timeout.
+	"""
+	import shlex
+	import time
+	from pwdmgr_model import create_random_passwords
+	with tempfile.TemporaryDirectory() as home:
+		session = pwdmgr_core.create_test_session(home)
+		conf = Configuration(pwdmgr_core.TEST_MAIL, os.path.join(home, "test.gpg"))
+		pwds = create_random_passwords(20)
+		pwdmgr_core.save_encrypt(conf, pwds, session)
+		path = os.path.join(home, "agent.sock")
+		agent, ready = Agent(conf, session, idle_timeout=1, write_delay=0.1), threading.Event()
+		loop = asyncio.new_event_loop()
+		thread = threading.Thread(target=loop.run_until_complete, args=(agent.serve(path, ready),))
+		thread.start()
+		ready.wait()
+		try:
+			with Client(path) as client:
+				label = pwds[5].label
+				assert client.query(f"get {shlex.quote(label)}")["result"] == [pwds[5].password]
+				assert "error" in client.query("get")
+				client.query(f"set {shlex.quote(label)} password=changed")
+				time.sleep(0.5)
+				assert agent.lookup is not None
+				assert pwdmgr_core.load_decrypt(conf, session)[5].password == "changed"
+
+				time.sleep(1.5)
+				assert agent.lookup is None  # dropped after idle timeout
+				assert client.query(f"get {shlex.quote(label)}")["result"] == ["changed"]
+				assert agent.lookup is not None
+				client.query("lock")
+				assert agent.lookup is None
+		finally:
+			loop.call_soon_threadsafe(agent.stop)
+			thread.join()
+			loop.close()
+		assert not os.path.exists(path)
+
+
+def main():
+	"""Run the agent in the foreground
+	"""
+	parser = argparse.ArgumentParser(description="Password Manager Agent")
+	parser.add_argument("-s", "--socket", dest="socket", help="Path of the socket")
+	parser.add_argument("-t", "--timeout", type=int, default=IDLE_TIMEOUT, dest="timeout", help="Idle timeout in seconds")
+	args = parser.parse_args()
+	conf = config.load_config()
+	print(f"Using {conf}")
+	lock_memory()
+	asyncio.run(Agent(conf, idle_timeout=args.timeout).serve(args.socket or default_socket()))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+"""Offline breach audit for simple Password Manager.
+
+Checks the passwords against a local list of SHA-1 hashes of breached
+passwords, such as the "Pwned Passwords" list of haveibeenpwned.com, without
+any network access. The list can be given either as the original text file,
+with one line `<SHA-1 in hex>:<count>` per hash, ordered by hash, or as a file
+of the raw 20-byte digests, ordered, without counts.
+
+Those files are several GB large, so they are never read entirely; instead, the
+file is memory-mapped and each hash is looked up by binary search, so that
+only a few pages of the file are read per lookup (and cached by the OS). The
+passwords are hashed in the calling process, and only the sorted digests are
+passed in chunks to a pool of worker processes doing the lookups, each
+resuming its search where the previous digest was found.
+
+Use the `audit` command of `pwdmgr_cli.py`, or the "Audit" button in the UI.
+"""
+
+import hashlib
+import mmap
+import multiprocessing
+import os
+import string
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Dict, List, Tuple
+
+from pwdmgr_model import Password
+
+DIGEST_SIZE = 20      # bytes of SHA-1 digest, i.e. of records in binary file
+HEX_SIZE = 40         # hex digits of SHA-1 digest, at start of lines in text file
+CHUNK_SIZE = 10_000   # number of digests to look up per task
+MAX_WORKERS = min(8, os.cpu_count() or 1)
+
+_HEX_DIGITS = frozenset(string.hexdigits.encode())
+
+
+class BreachList:
+	"""Memory-mapped, sorted list of SHA-1 hashes of breached passwords, in
+	either text or binary format; see above.
+	"""
+
+	def __init__(self, path: str):
+		self.path = path
+		with open(path, "rb") as f:
+			self.size = os.fstat(f.fileno()).st_size
+			self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b""
+		if self.size and hasattr(self.mm, "madvise"):
+			self.mm.madvise(mmap.MADV_RANDOM)  # no read-ahead for binary search
+		head = self.mm[:HEX_SIZE + 1]
+		if len(head) == HEX_SIZE + 1 and _HEX_DIGITS.issuperset(head[:HEX_SIZE]) and head[-1:] in b":\r\n":
+			self.is_text = True
+		elif self.size % DIGEST_SIZE == 0:
+			self.is_text = False
+		else:
+			raise ValueError(f"Not a list of SHA-1 hashes: {path}")
+
+	def find(self, digest: bytes, lo: int = 0) -> Tuple[int, int]:
+		"""Find the digest, starting at the given offset, which must be the
+		start of a record; get number of times it was found in breaches (zero
+		if not in list, or one if the list has no counts), and the offset for
+		looking up the next larger digest.
+		"""
+		if self.is_text:
+			return self._find_text(digest.hex().upper().encode(), lo)
+		return self._find_binary(digest, lo)
+
+	def _find_text(self, key: bytes, lo: int) -> Tuple[int, int]:
+		mm, hi = self.mm, self.size
+		while lo < hi:
+			mid = (lo + hi) // 2
+			start = mm.rfind(b"\n", lo, mid) + 1 or lo
+			end = mm.find(b"\n", start)
+			end = hi if end < 0 else end
+			line = mm[start:end]
+			found = line[:HEX_SIZE].upper()
+			if found == key:
+				count = line[HEX_SIZE + 1:].strip()
+				return int(count) if count.isdigit() else 1, start
+			if found < key:
+				lo = end + 1
+			else:
+				hi = start
+		return 0, lo
+
+	def _find_binary(self, digest: bytes, lo: int) -> Tuple[int, int]:
+		mm = self.mm
+		lo, hi = lo // DIGEST_SIZE, self.size // DIGEST_SIZE
+		while lo < hi:
+			mid = (lo + hi) // 2
+			found = mm[mid * DIGEST_SIZE:(mid + 1) * DIGEST_SIZE]
+			if found == digest:
+				return 1, mid * DIGEST_SIZE
+			if found < digest:
+				lo = mid + 1
+			else:
+				hi = mid
+		return 0, lo * DIGEST_SIZE
+
+	def counts(self, digests: List[bytes]) -> List[int]:
+		"""Get breach counts for the sorted digests, each search resuming at
+		the position of the previous one.
+		"""
+		result, lo = [], 0
+		for digest in digests:
+			count, lo = self.find(digest, lo)
+			result.append(count)
+		return result
+
+	def close(self):
+		if self.size:
+			self.mm.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *_args):
+		self.close()
+
+
+def sha1(password: str) -> bytes:
+	return hashlib.sha1(password.encode("utf-8")).digest()
+
+
+def _lookup_chunk(path: str, digests: List[bytes]) -> List[int]:
+	# run in worker process; opens its own mapping of the file
+	with BreachList(path) as breaches:
+		return breaches.counts(digests)
+
+
+def audit(passwords: List[Password], path: str, workers: int = MAX_WORKERS,
+          chunk_size: int = CHUNK_SIZE) -> Dict[int, int]:
+	"""Check the passwords against the list of breached hashes in the given
+	file; get the positions of the breached passwords, and how often each was
+	found in breaches. Empty passwords are skipped; reused ones looked up once.
+	"""
+	positions = {}
+	for i, p in enumerate(passwords):
+		if p.password:
+			positions.setdefault(sha1(p.password), []).append(i)
+	digests = sorted(positions)
+	chunks = [digests[i:i + chunk_size] for i in range(0, len(digests), chunk_size)]
+	if workers > 1 and len(chunks) > 1:
+		# spawn, not fork, as the callers may have other threads running
+		context = multiprocessing.get_context("spawn")
+		with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), mp_context=context) as pool:
+			counts = [c for chunk in pool.map(_lookup_chunk, repeat(path), chunks) for c in chunk]
+	else:
+		counts = [c for chunk in chunks for c in _lookup_chunk(path, chunk)]
+	return {i: count for digest, count in zip(digests, counts) if count
+	                 for i in positions[digest]}
+
+
+def write_test_list(path: str, passwords: List[str], n_random: int = 1000, binary: bool = False):
+	"""Write list of hashes of the given passwords plus random hashes in
+	text or binary format, for testing and benchmarks.
+	"""
+	digests = {sha1(p) for p in passwords} | {os.urandom(DIGEST_SIZE) for _ in range(n_random)}
+	with open(path, "wb") as f:
+		for i, digest in enumerate(sorted(digests)):
+			f.write(digest if binary else b"%s:%d\r\n" % (digest.hex().upper().encode(), i % 100 + 1))
+
+
+def test():
+	"""Just for testing lookups in text and binary lists, with a small test
+	list in a temporary directory.
+	"""
+	import tempfile
+	from pwdmgr_model import create_random_passwords
+	pwds = create_random_passwords(500)
+	breached = {i for i in range(0, 500, 7)}
+	pwds[3].password = pwds[7].password  # reused breached password
+	pwds[4].password = ""
+	with tempfile.TemporaryDirectory() as tmp:
+		for binary in (False, True):
+			path = os.path.join(tmp, "hashes")
+			write_test_list(path, [pwds[i].password for i in breached], 2000, binary)
+			for workers in (1, 2):
+				found = audit(pwds, path, workers, chunk_size=100)
+				assert set(found) == breached | {3}, (binary, workers)
+				assert binary or all(count >= 1 for count in found.values())
+		open(path, "w").close()
+		assert audit(pwds, path) == {}
+
+
+# testing stuff
+if __name__ == "__main__":
+	test()
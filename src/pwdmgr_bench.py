@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+"""Benchmarks for simple Password Manager.
+
+Non-interactive benchmarks for the performance-relevant parts of the password
+manager, using synthetic passwords (realistic random ones by default, always
+the same) and a throwaway GPG keyring. Run e.g. `python3 pwdmgr_bench.py json`,
+or without arguments for all benchmarks.
+
+For comparing results between commits, use `-o bench.jsonl` for appending them
+to a file, together with the current commit; then, after making changes, use
+`-o bench.jsonl -c <commit>` to show the differences to that commit's results.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import functools
+import gc
+import io
+import os
+import json
+import platform
+import random
+import shlex
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from pwdgen import generate_bulk
+from pwdmgr_agent import Agent, Client
+from pwdmgr_core import TEST_MAIL, GPGSession, create_test_session, load_decrypt, save_encrypt
+from pwdmgr_index import SEPARATOR, SearchIndex, TagIndex, search_key, sort_key
+import pwdmgr_io
+from pwdmgr_journal import ChangeJournal
+from pwdmgr_model import (FORMATS, Configuration, Password, create_random_passwords,
+                          create_test_passwords, load_from_json, write_to_bytes)
+
+DATASETS = {
+	"realistic": create_random_passwords,
+	"simple": create_test_passwords,
+}
+create_passwords = create_random_passwords  # may be changed with --data
+
+RESULTS = []  # results of this run, for writing to file
+
+
+def result(benchmark, n, variant="", **metrics):
+	"""Print and keep result of benchmark for given size and variant, e.g.
+	the JSON format, with metrics such as times, named with their unit.
+	"""
+	RESULTS.append({"benchmark": benchmark, "n": n, "variant": variant, **metrics})
+	print(f"{describe(benchmark, n, variant)}: " + ", ".join(f"{k} {v:.4g}" for k, v in metrics.items()))
+
+
+def describe(benchmark, n, variant):
+	return benchmark + (f" n={n:>8}" if n else "") + (f" {variant}" if variant else "")
+
+
+class DictPassword:
+	"""Reference implementation of the previous, dict-based Password class.
+	"""
+
+	def __init__(self, label, username, password, email, url, notes, tags, last_changed):
+		self.label = label
+		self.username = username
+		self.password = password
+		self.email = email
+		self.url = url
+		self.notes = notes
+		self.tags = tags
+		self.last_changed = last_changed
+
+
+def measure_memory(create) -> int:
+	"""Return number of bytes still allocated by the result of create().
+	"""
+	gc.collect()
+	tracemalloc.start()
+	result = create()
+	size, _ = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	del result
+	return size
+
+
+def bench_memory(sizes):
+	"""Compare memory used by slotted Password and dict-based reference class.
+	"""
+	for n in sizes:
+		# same strings for both, so only the per-object overhead differs
+		values = [p.values() for p in create_passwords(n)]
+		old = measure_memory(lambda: [DictPassword(*v) for v in values])
+		new = measure_memory(lambda: [Password(*v) for v in values])
+		result("memory", n, dict_bytes_per_entry=old / n, slots_bytes_per_entry=new / n)
+
+
+def measure_time(func, repeat=1, min_time=0.2) -> float:
+	"""Return average time in seconds needed for calling func, calling it at
+	least the given number of times, and more often for fast functions, for
+	getting results that are comparable between runs.
+	"""
+	gc.collect()
+	count, start = 0, time.perf_counter()
+	while count < repeat or time.perf_counter() - start < min_time:
+		func()
+		count += 1
+	return (time.perf_counter() - start) / count
+
+
+def bench_search(sizes):
+	"""Compare per-keystroke filter latency of the search index with a linear
+	scan, normalizing all attributes of all rows, like the old filter did, and
+	with a linear scan over the precomputed search keys of the rows, typing
+	the username of one of the passwords.
+	"""
+	for n in sizes:
+		rows = [p.values() for p in create_passwords(n)]
+		query = rows[n // 2][1]
+		build = measure_time(lambda: SearchIndex(enumerate(rows)))
+		keying = measure_time(lambda: [SEPARATOR.join(map(search_key, vals)) for vals in rows])
+		result("search", n, "build", index_ms=build * 1000, keys_ms=keying * 1000)
+		index = SearchIndex(enumerate(rows))
+		keys = [SEPARATOR.join(map(search_key, vals)) for vals in rows]
+		for k in range(1, len(query) + 1):
+			text = query[:k]
+			old = measure_time(lambda: [i for i, vals in enumerate(rows)
+			                            if any(search_key(text) in search_key(att) for att in vals)])
+			def keyed():
+				key = search_key(text)
+				return [i for i, row_key in enumerate(keys) if key in row_key]
+			def indexed():
+				matches = index.search(text)
+				return [i for i in range(n) if i in matches]
+			memo, new = measure_time(keyed), measure_time(indexed)
+			result("search", n, f"len={k}", linear_ms=old * 1000, keys_ms=memo * 1000,
+			       index_ms=new * 1000)
+
+
+def bench_tags(sizes):
+	"""Compare counting the tags for the Tags menu by scanning all passwords,
+	like the old menu did, with the tag index, and filtering by two tags.
+	"""
+	for n in sizes:
+		pwds = create_passwords(n)
+		index = TagIndex(enumerate(p.tags for p in pwds))
+		tags = sorted(index.counts(), key=index.counts().get)[-2:]
+		old = measure_time(lambda: Counter(tag.strip() for p in pwds for tag in p.tags.split(",")))
+		new = measure_time(index.counts)
+		search = measure_time(lambda: index.search(tags, match_all=False))
+		result("tags", n, scan_ms=old * 1000, index_ms=new * 1000, filter_ms=search * 1000)
+
+
+def bench_sort(sizes):
+	"""Compare sorting by label and by date with a comparison function that
+	computes the sort keys in each comparison, like a sort function of a GTK
+	sort model would, with computing the keys once, and with cached keys.
+	"""
+	for n in sizes:
+		pwds = create_passwords(n)
+		for att in ("label", "last_changed"):
+			values = [getattr(p, att) for p in pwds]
+			key_func = sort_key(att)
+			def compare(a, b):
+				ka, kb = key_func(a), key_func(b)
+				return (ka > kb) - (ka < kb)
+			old = measure_time(lambda: sorted(values, key=functools.cmp_to_key(compare)))
+			new = measure_time(lambda: sorted(values, key=key_func))
+			keys = {i: key_func(v) for i, v in enumerate(values)}
+			cached = measure_time(lambda: sorted(range(n), key=keys.__getitem__))
+			result("sort", n, att, compare_ms=old * 1000, keys_ms=new * 1000, cached_ms=cached * 1000)
+
+
+def bench_json(sizes):
+	"""Compare serializing and parsing passwords in the different formats.
+	"""
+	for n in sizes:
+		pwds = create_passwords(n)
+		for fmt in FORMATS:
+			data = write_to_bytes(pwds, fmt)
+			dump = measure_time(lambda: write_to_bytes(pwds, fmt))
+			load = measure_time(lambda: load_from_json(data))
+			result("json", n, fmt, bytes_per_entry=len(data) / n, write_ms=dump * 1000, load_ms=load * 1000)
+
+
+def bench_import(sizes):
+	"""Measure throughput of reading a CSV file through the import pipeline,
+	and its peak memory when not keeping the passwords, i.e. the memory that
+	does not grow with the size of the file, and of merging them, first into
+	an empty list, then again into the same passwords, i.e. updating them.
+	"""
+	for n in sizes:
+		with tempfile.TemporaryDirectory() as tmp:
+			path = os.path.join(tmp, "import.csv")
+			pwdmgr_io.export(create_passwords(n), path, "csv")
+			with contextlib.redirect_stderr(io.StringIO()):
+				read = measure_time(lambda: sum(1 for _ in pwdmgr_io.read(path)))
+				tracemalloc.start()
+				sum(1 for _ in pwdmgr_io.read(path))
+				peak = tracemalloc.get_traced_memory()[1]
+				tracemalloc.stop()
+				passwords = []
+				add = measure_time(lambda: pwdmgr_io.merge(passwords, pwdmgr_io.read(path)), min_time=0)
+				update = measure_time(lambda: pwdmgr_io.merge(passwords, pwdmgr_io.read(path)), min_time=0)
+			result("import", n, "csv", bytes=os.path.getsize(path), records_per_s=n / read,
+			       read_peak_mb=peak / 2**20, add_ms=add * 1000, update_ms=update * 1000)
+
+
+def bench_gpg(sizes, rounds=10):
+	"""Measure encryption and decryption with one shared GPG session, and
+	compare save/load round-trips using a new session for each operation, like
+	it was done before.
+	"""
+	with tempfile.TemporaryDirectory() as home:
+		session = create_test_session(home)
+		session.launch_agent()
+		config = Configuration(TEST_MAIL, os.path.join(home, "passwords.gpg"))
+		for n in sizes:
+			pwds = create_passwords(n)
+			def fresh():
+				save_encrypt(config, pwds, GPGSession(home))
+				load_decrypt(config, GPGSession(home))
+			with contextlib.redirect_stdout(io.StringIO()):
+				old = measure_time(fresh, rounds)
+				encrypt = measure_time(lambda: save_encrypt(config, pwds, session), rounds)
+				decrypt = measure_time(lambda: load_decrypt(config, session), rounds)
+			result("gpg", n, fresh_ms=old * 1000, encrypt_ms=encrypt * 1000, decrypt_ms=decrypt * 1000)
+
+
+def old_generate(num=20, groups=(string.ascii_lowercase, string.ascii_uppercase,
+                                  string.digits, string.punctuation)):
+	"""Reference implementation of the previous, one-by-one password generator.
+	"""
+	return ''.join(random.choice(random.choice(groups)) for _ in range(num))
+
+
+def bench_pwdgen(sizes, num=20):
+	"""Compare throughput of bulk password generation with the old generator.
+	"""
+	for n in sizes:
+		old = measure_time(lambda: [old_generate(num) for _ in range(n)])
+		new = measure_time(lambda: list(generate_bulk(n, num)))
+		result("pwdgen", n, old_per_s=n / old, bulk_per_s=n / new)
+
+
+def bench_agent(sizes, rounds=1000):
+	"""Compare time for decrypting the passwords, as needed for each lookup
+	without the agent, with the time for a lookup from the running agent.
+	"""
+	with tempfile.TemporaryDirectory() as home:
+		session = create_test_session(home)
+		config = Configuration(TEST_MAIL, os.path.join(home, "passwords.gpg"))
+		socket_path = os.path.join(home, "agent.sock")
+		for n in sizes:
+			pwds = create_passwords(n)
+			query = f"get {shlex.quote(pwds[n // 2].label)}"
+			with contextlib.redirect_stdout(io.StringIO()):
+				save_encrypt(config, pwds, session)
+				decrypt = measure_time(lambda: load_decrypt(config, session), 5)
+				agent, ready = Agent(config, session), threading.Event()
+				loop = asyncio.new_event_loop()
+				thread = threading.Thread(target=loop.run_until_complete, args=(agent.serve(socket_path, ready),))
+				thread.start()
+				ready.wait()
+				with Client(socket_path) as client:
+					lookup = measure_time(lambda: client.query(query), rounds)
+				loop.call_soon_threadsafe(agent.stop)
+				thread.join()
+				loop.close()
+			result("agent", n, decrypt_ms=decrypt * 1000, lookup_ms=lookup * 1000)
+
+
+def bench_gtk(sizes):
+	"""Measure time for filling the table model, compared to the ListStore used
+	before, and for opening the main window until all passwords are loaded and
+	shown. Needs a display; for running headless, use e.g. `xvfb-run`.
+	"""
+	try:
+		import pwdmgr_gtk
+		from gi.repository import Gdk, GLib, Gtk
+	except (ImportError, ValueError) as e:
+		return print(f"gtk: skipped, {e}")
+	if Gdk.Display.get_default() is None:
+		return print("gtk: skipped, no display")
+	config = Configuration(TEST_MAIL, os.devnull)
+	for n in sizes:
+		passwords = create_passwords(n)
+		def fill_list_store():
+			store = Gtk.ListStore(*pwdmgr_gtk.COLUMN_TYPES)
+			for i, p in enumerate(passwords):
+				store.append([*p.values(), i, None, None, False, ""])
+		def fill_password_store():
+			store = pwdmgr_gtk.PasswordStore(ChangeJournal(passwords), [""])
+			for i, p in enumerate(passwords):
+				store.append(i, p)
+		old, new = measure_time(fill_list_store), measure_time(fill_password_store)
+
+		times = {}
+		def wait_loaded():
+			if frame.loading:
+				return True
+			times["loaded"] = time.perf_counter() - start
+			GLib.idle_add(shown, priority=GLib.PRIORITY_LOW)
+			return False
+		def shown():
+			times["shown"] = time.perf_counter() - start
+			frame.window.destroy()  # also quits main loop
+			return False
+		with contextlib.redirect_stdout(io.StringIO()):
+			start = time.perf_counter()
+			frame = pwdmgr_gtk.PwdMgrFrame(config, passwords)
+			times["window"] = time.perf_counter() - start
+			GLib.timeout_add(5, wait_loaded)
+			Gtk.main()
+		result("gtk", n, fill_liststore_ms=old * 1000, fill_passwordstore_ms=new * 1000,
+		       **{f"{step}_ms": t * 1000 for step, t in times.items()})
+
+
+# budgets for importing the modules of the UI and CLI (with cached bytecode),
+# and for the UI from starting the process until the window is first painted
+STARTUP_BUDGET_MS = {"pwdmgr_cli": 100, "pwdmgr_gtk": 400, "first_paint": 1000}
+
+PAINT_SCRIPT = """
+import os, sys
+try:
+	import pwdmgr_gtk
+	from gi.repository import Gdk, Gtk
+except ImportError:
+	sys.exit(3)
+if Gdk.Display.get_default() is None:
+	sys.exit(3)
+import pwdmgr_model
+frame = pwdmgr_gtk.PwdMgrFrame(pwdmgr_model.Configuration("", os.devnull), [])
+def painted(*_args):
+	print("painted", flush=True)
+	frame.window.destroy()
+frame.window.connect_after("draw", painted)
+Gtk.main()
+"""
+
+
+def measure_import(module) -> dict:
+	"""Import module in a new process with `-X importtime`; return the time
+	for importing it and each of the modules it imports, in milliseconds.
+	"""
+	proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+	                      capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+	if proc.returncode != 0:
+		raise ImportError(proc.stderr.strip().splitlines()[-1])
+	times = {}
+	for line in proc.stderr.splitlines():
+		if line.startswith("import time:") and "|" in line:
+			_, cumulative, name = line.split("|")
+			if cumulative.strip().isdigit():
+				times[name.strip()] = int(cumulative) / 1000
+	return times
+
+
+def bench_startup(_sizes, runs=5):
+	"""Measure import time of CLI and UI (best of some runs, after a first run
+	for caching the bytecode), show the slowest modules they import, and time
+	from starting the UI to its first paint; check those against the budgets.
+	"""
+	for module in ("pwdmgr_cli", "pwdmgr_gtk"):
+		try:
+			runs_times = [measure_import(module) for _ in range(runs + 1)][1:]
+		except ImportError as e:
+			print(f"startup {module}: skipped, {e}")
+			continue
+		times = min(runs_times, key=lambda t: t[module])
+		result("startup", 0, module, import_ms=times[module])
+		slowest = sorted((name for name in times if name != module), key=times.get, reverse=True)[:5]
+		print("    slowest: " + ", ".join(f"{name} {times[name]:.1f} ms" for name in slowest))
+		check_budget(module, times[module])
+
+	cwd = os.path.dirname(os.path.abspath(__file__))
+	paint = []
+	for _ in range(runs):
+		start = time.perf_counter()
+		proc = subprocess.run([sys.executable, "-c", PAINT_SCRIPT], capture_output=True, text=True, cwd=cwd)
+		if "painted" not in proc.stdout:
+			return print("startup first_paint: skipped, no GTK or display" if proc.returncode == 3 else
+			             f"startup first_paint: failed, {proc.stderr.strip()[-200:]}")
+		paint.append(time.perf_counter() - start)
+	result("startup", 0, "first_paint", total_ms=min(paint) * 1000)
+	check_budget("first_paint", min(paint) * 1000)
+
+
+def check_budget(name, millis):
+	if millis > STARTUP_BUDGET_MS[name]:
+		print(f"    OVER BUDGET: {name} took {millis:.1f} ms, budget is {STARTUP_BUDGET_MS[name]} ms")
+		OVER_BUDGET.append(name)
+
+
+OVER_BUDGET = []  # names of startup checks over budget, for the exit code
+
+
+BENCHMARKS = {
+	"memory": lambda args: bench_memory(args.sizes or [10_000, 100_000, 1_000_000]),
+	"search": lambda args: bench_search(args.sizes or [50_000]),
+	"gpg": lambda args: bench_gpg(args.sizes or [10, 1_000]),
+	"pwdgen": lambda args: bench_pwdgen(args.sizes or [1_000, 100_000]),
+	"tags": lambda args: bench_tags(args.sizes or [10_000, 100_000]),
+	"sort": lambda args: bench_sort(args.sizes or [10_000, 100_000]),
+	"import": lambda args: bench_import(args.sizes or [10_000, 1_000_000]),
+	"json": lambda args: bench_json(args.sizes or [1_000, 10_000, 100_000]),
+	"agent": lambda args: bench_agent(args.sizes or [1_000, 100_000]),
+	"gtk": lambda args: bench_gtk(args.sizes or [10_000, 100_000]),
+	"startup": lambda args: bench_startup(args.sizes),
+}
+
+
+def get_commit() -> str:
+	"""Get hash of the current commit, marked if there are local changes.
+	"""
+	def git(*args):
+		return subprocess.run(["git", *args], capture_output=True, text=True,
+		                      cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+	try:
+		commit = git("rev-parse", "--short", "HEAD") or "unknown"
+		return commit + ("+dirty" if git("status", "--porcelain", "--untracked-files=no") else "")
+	except OSError:
+		return "unknown"
+
+
+def write_results(filename, data):
+	"""Append results of this run to file, as JSON lines, with the commit and
+	other details needed for comparing them with results of other runs.
+	"""
+	run = {"commit": get_commit(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "data": data,
+	       "python": platform.python_version(), "machine": platform.node()}
+	with open(filename, "a") as f:
+		for res in RESULTS:
+			f.write(json.dumps({**run, **res}) + "\n")
+
+
+def compare_results(filename, commit, data):
+	"""Show differences between results of this run and the latest results
+	for the given commit (or prefix thereof) and data in the file.
+	"""
+	old = {}
+	with open(filename) as f:
+		for line in f:
+			res = json.loads(line)
+			if res["commit"].startswith(commit) and res["data"] == data:
+				old[res["benchmark"], res["n"], res["variant"]] = res
+	if not old:
+		sys.exit(f"No results for commit {commit} in {filename}")
+	print(f"Compared to {commit}:")
+	for res in RESULTS:
+		key = res["benchmark"], res["n"], res["variant"]
+		for metric, value in res.items():
+			if key in old and metric not in ("benchmark", "n", "variant") and old[key].get(metric):
+				print(f"{describe(*key)}: {metric} {old[key][metric]:.4g} -> "
+				      f"{value:.4g} ({value / old[key][metric] - 1:+.1%})")
+
+
+def main():
+	"""Run selected benchmarks, or all of them
+	"""
+	global create_passwords
+	parser = argparse.ArgumentParser(description="Password Manager Benchmarks")
+	parser.add_argument("benchmarks", nargs="*", help=f"Benchmarks to run: {', '.join(BENCHMARKS)}")
+	parser.add_argument("-s", "--sizes", type=int, nargs="+", dest="sizes", help="Number of passwords")
+	parser.add_argument("-d", "--data", choices=DATASETS, default="realistic", dest="data", help="Kind of test passwords")
+	parser.add_argument("-o", "--output", dest="output", help="File for appending results to")
+	parser.add_argument("-c", "--compare", dest="compare", help="Compare with results of this commit in output file")
+	args = parser.parse_args()
+	unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+	if unknown:
+		parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+	create_passwords = DATASETS[args.data]
+	for name in args.benchmarks or BENCHMARKS:
+		BENCHMARKS[name](args)
+	if args.output and args.compare:
+		compare_results(args.output, args.compare, args.data)
+	if args.output:
+		write_results(args.output, args.data)
+	if OVER_BUDGET:
+		sys.exit(f"Over budget: {', '.join(OVER_BUDGET)}")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+"""Append-only change log for simple Password Manager.
+
+In append-only mode, saving does not rewrite the entire password file, but
+appends an encrypted record with the changes since the last save to a log file
+next to it, so the cost of saving depends on the size of the change, not on the
+number of passwords: the callers pass the changes they recorded anyway (e.g. in
+the change journal) as pairs of old and new password, which are turned into log
+operations directly, without comparing the passwords. Loading decrypts the
+password file (the "snapshot") and replays the records in the log. Once the log
+grows too long, it is compacted, i.e. the current passwords are written as a
+new snapshot and the log removed.
+
+Entries are identified by their position in the snapshot, and new entries by
+consecutive numbers after those. Each record is a JSON object like this, with
+the digest of the snapshot it applies to (records for other snapshots, e.g. if
+compaction was interrupted, are ignored), and a list of operations:
+
+    {"base": digest, "ops": [["add", id, [values]], ["mod", id, [values]],
+                             ["del", id], ...]}
+
+New entries are always appended at the end of the list when replaying.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pwdmgr_model import ATTRIBUTES, Configuration, Password, write_to_bytes
+
+LOG_END = "-----END PGP MESSAGE-----"
+MAX_RECORDS = 50  # compact when log has more records than this...
+MIN_SIZE = 2**20  # ...or is larger than the snapshot and this many bytes
+
+
+Change = Tuple[Optional[Password], Optional[Password]]  # (old, new), None if added/deleted
+
+
+class LogState:
+	"""State of the passwords as of the last load or save, as ordered mapping
+	of entry ID to Password, and of each Password's identity to its entry ID,
+	needed for turning the changes into operations on those entries.
+	"""
+
+	def __init__(self, base: str, passwords: Iterable[Password]):
+		self.base = base
+		self.entries = dict(enumerate(passwords))
+		self.ids = {id(p): eid for eid, p in self.entries.items()}
+		self.next_id = len(self.entries)
+		self.records = 0
+		self.size = 0
+
+	def apply(self, ops: List[list]):
+		"""Apply operations from a log record to the entries, when replaying.
+		"""
+		for op, eid, *values in ops:
+			self.set(eid, None if op == "del" else Password(*values[0]))
+
+	def set(self, eid: int, password: Optional[Password]):
+		"""Set the entry with given ID to the Password, or remove it if None.
+		"""
+		old = self.entries.pop(eid, None) if password is None else self.entries.get(eid)
+		if old is not None:
+			del self.ids[id(old)]
+		if password is not None:
+			self.entries[eid] = password
+			self.ids[id(password)] = eid
+			self.next_id = max(self.next_id, eid + 1)
+
+	def knows(self, changes: List[Change]) -> bool:
+		"""Check whether all the old passwords of the changes are entries.
+		"""
+		return all(old is None or id(old) in self.ids for old, _ in changes)
+
+	def to_ops(self, changes: List[Change]) -> List[list]:
+		"""Get one operation for each of the changes, with new IDs for added
+		passwords; the entries themselves are updated only by `record`.
+		"""
+		ops, next_id = [], self.next_id
+		for old, new in changes:
+			if old is None:
+				ops.append(["add", next_id, new.values()])
+				next_id += 1
+			elif new is None:
+				ops.append(["del", self.ids[id(old)]])
+			else:
+				ops.append(["mod", self.ids[id(old)], new.values()])
+		return ops
+
+	def record(self, changes: List[Change], ops: List[list]):
+		"""Update the entries after the operations have been written, keeping
+		the callers' Passwords, so they are recognized in the next changes.
+		"""
+		for (_old, new), (_op, eid, *_values) in zip(changes, ops):
+			self.set(eid, new)
+
+
+_states: Dict[str, LogState] = {}
+
+
+def log_file(config: Configuration) -> str:
+	return config.filename + ".log"
+
+
+def file_digest(filename: str) -> str:
+	"""Get digest of the (encrypted) snapshot file, identifying the snapshot.
+	"""
+	with open(filename, "rb") as f:
+		return hashlib.sha256(f.read()).hexdigest()
+
+
+def read_records(config: Configuration) -> List[str]:
+	"""Get the individual encrypted records in the log file, if any.
+	"""
+	try:
+		with open(log_file(config), "r") as f:
+			text = f.read()
+	except FileNotFoundError:
+		return []
+	return [block + LOG_END for block in text.split(LOG_END) if block.strip()]
+
+
+def load(config: Configuration, session) -> List[Password]:
+	"""Load passwords from snapshot and replay the changes from the log.
+	"""
+	print("decrypting...")
+	snapshot = json.loads(session.decrypt(config.filename))
+	state = LogState(file_digest(config.filename),
+	                 (Password(*(d[att] for att in ATTRIBUTES)) for d in snapshot))
+	records = read_records(config)
+	if records:
+		print(f"replaying {len(records)} changes...")
+	for cipher in records:
+		record = json.loads(session.decrypt_text(cipher))
+		if record["base"] == state.base:
+			state.apply(record["ops"])
+			state.records += 1
+			state.size += len(cipher)
+	_states[config.filename] = state
+	return list(state.entries.values())
+
+
+def save(config: Configuration, session, passwords: List[Password], changes: List[Change] = None):
+	"""Append the changes since the last load or save, as pairs of old and new
+	Password (old one None if added, new one None if deleted), to the log; or
+	write the passwords as new snapshot if the changes are not known, the log
+	is due for compaction, or there is no known state.
+	"""
+	state = _states.get(config.filename)
+	if (state is None or changes is None or not state.knows(changes)
+			or not os.path.isfile(config.filename)
+			or state.records >= MAX_RECORDS
+			or state.size >= max(MIN_SIZE, os.path.getsize(config.filename))):
+		return compact(config, session, passwords)
+
+	ops = state.to_ops(changes)
+	if ops:
+		print(f"appending {len(ops)} changes...")
+		cipher = session.encrypt(json.dumps({"base": state.base, "ops": ops}), config.usermail)
+		with open(log_file(config), "a") as f:
+			f.write(cipher.rstrip() + "\n")
+		state.record(changes, ops)
+		state.records += 1
+		state.size += len(cipher)
+
+
+def compact(config: Configuration, session, passwords: List[Password]):
+	"""Write passwords as new snapshot (with backup) and remove the log.
+	"""
+	print("compacting...")
+	cipher = session.encrypt(write_to_bytes(passwords, config.json_format), config.usermail)
+	if os.path.isfile(config.filename):
+		shutil.copy(config.filename, config.filename + ".bak")
+	with open(config.filename, "w") as f:
+		f.write(cipher)
+	if os.path.isfile(log_file(config)):
+		os.remove(log_file(config))
+	_states[config.filename] = LogState(file_digest(config.filename), passwords)
+
+
+def test():
+	"""Just for testing appending, replaying and compacting the log, using a
+	throwaway keyring.
+	"""
+	import tempfile
+	from pwdmgr_core import TEST_MAIL, create_test_session
+	from pwdmgr_model import create_random_passwords
+	with tempfile.TemporaryDirectory() as home:
+		session = create_test_session(home)
+		conf = Configuration(TEST_MAIL, os.path.join(home, "test.gpg"), append_only=True)
+		save(conf, session, create_random_passwords(20))  # no state yet: snapshot
+
+		_states.clear()
+		pwds = load(conf, session)
+		modified = Password(*pwds[0].values())
+		modified.notes = "modified"
+		added = Password(*pwds[5].values())
+		added.label = "added"
+		current = [modified, *pwds[2:], added]
+		save(conf, session, current, [(pwds[0], modified), (pwds[1], None), (None, added)])
+		pwds[2].password = "changed in place"
+		save(conf, session, current, [(pwds[2], pwds[2])])
+		assert len(read_records(conf)) == 2
+
+		_states.clear()
+		assert load(conf, session) == current
+		assert _states[conf.filename].records == 2
+
+		# log of an older snapshot is ignored, e.g. if compaction was interrupted
+		with open(log_file(conf)) as f:
+			stale = f.read()
+		compact(conf, session, current[:5])
+		with open(log_file(conf), "w") as f:
+			f.write(stale)
+		_states.clear()
+		assert load(conf, session) == current[:5]
+		assert _states[conf.filename].records == 0
+
+		# unknown changes, or changes of unknown passwords, write a snapshot
+		save(conf, session, current, [(added, None)])
+		assert not os.path.isfile(log_file(conf))
+
+
+# testing stuff
+if __name__ == "__main__":
+	test()
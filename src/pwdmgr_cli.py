@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+"""Command line interface for simple Password Manager.
+
+Headless access to the passwords, e.g. for scripts, using the same config and
+password file as the UI. Each invocation decrypts the passwords only once, so
+for many lookups, pass them all at once in batch mode, one query per line:
+
+    pwdmgr_cli.py get <label> [-f field]    print field (default: password)
+    pwdmgr_cli.py search <text>             list entries containing text
+    pwdmgr_cli.py site <url>                list entries for site of URL or host
+    pwdmgr_cli.py list [--tags t1,t2]       list all entries (having all tags,
+                       [--any]              or any of the tags)
+    pwdmgr_cli.py set <label> field=value   create or update an entry
+    pwdmgr_cli.py reused                    list entries sharing a password
+    pwdmgr_cli.py import <file>             add or update entries from CSV,
+                                            KeePass XML, or plain JSON file
+    pwdmgr_cli.py export <file> [-f csv]    write entries as CSV or JSON,
+                  [-e, --encrypt]           plain or encrypted
+    pwdmgr_cli.py audit [hashes-file]       list entries with breached passwords
+    pwdmgr_cli.py batch < queries.txt       answer queries from stdin as JSON
+
+With `--agent`, queries (except import, export and audit) are sent to a running unlock agent (see
+`pwdmgr_agent.py`) instead, and answered as JSON without decrypting anything.
+
+Listed entries are shown as label, username and URL, separated by tabs; the
+password is only ever printed by `get`. Tip: `alias pwdmgr="python3 .../pwdmgr_cli.py"`
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import shlex
+import sys
+from typing import Dict, Iterable, List, Tuple
+
+import config
+import pwdmgr_core
+import pwdmgr_io
+from pwdmgr_index import HostIndex, ReuseIndex, SearchIndex, TagIndex
+from pwdmgr_model import ATTRIBUTES, Password
+
+_batch_parser = None  # created on first query in batch mode
+
+
+class Lookup:
+	"""Decrypted passwords of all vaults, with lookup structures built on first
+	use, so that they can be reused for answering many queries, and the vault
+	of each password, so that only changed vaults have to be saved. Changes
+	are recorded as pairs of old and new Password, as needed for appending
+	them to the log in append-only mode, and update only the entries of the
+	changed passwords in the lookup structures that have already been built.
+	"""
+
+	def __init__(self, passwords: List[Password], vaults: List[int] = None):
+		self.passwords = passwords
+		self.vaults = vaults or [0] * len(passwords)
+		self.changes = {}  # number of vault -> {id of Password: (old, new)}
+		self._labels = None
+		self._positions = None
+		self._index = None
+		self._tag_index = None
+		self._reuse_index = None
+		self._host_index = None
+
+	@classmethod
+	def from_groups(cls, groups: List[List[Password]]) -> "Lookup":
+		"""Create lookup for the passwords of the vaults, one list per vault.
+		"""
+		return cls([p for group in groups for p in group],
+		           [i for i, group in enumerate(groups) for _ in group])
+
+	def groups(self, n_vaults: int) -> List[List[Password]]:
+		"""Get the passwords of each vault, e.g. for saving them.
+		"""
+		groups = [[] for _ in range(n_vaults)]
+		for p, vault in zip(self.passwords, self.vaults):
+			groups[vault].append(p)
+		return groups
+
+	@property
+	def modified(self) -> bool:
+		return bool(self.changes)
+
+	def get_changes(self) -> Dict[int, List[Tuple[Password, Password]]]:
+		"""Get the changes since the last save, by vault, e.g. for saving.
+		"""
+		return {vault: list(changes.values()) for vault, changes in self.changes.items()}
+
+	def _record(self, vault: int, old: Password, new: Password):
+		# keep first change of each password, i.e. whether it is new or not
+		self.changes.setdefault(vault, {}).setdefault(id(new), (old, new))
+
+	@property
+	def labels(self) -> Dict[str, List[Password]]:
+		if self._labels is None:
+			self._labels = {}
+			for p in self.passwords:
+				self._labels.setdefault(p.label.lower(), []).append(p)
+		return self._labels
+
+	@property
+	def positions(self) -> Dict[int, int]:
+		if self._positions is None:
+			self._positions = {id(p): i for i, p in enumerate(self.passwords)}
+		return self._positions
+
+	def _update(self, i: int, old_label: str = None):
+		"""Update the lookup structures built so far for the password at the
+		given position, after it was added (without old label) or changed.
+		"""
+		pwd = self.passwords[i]
+		if self._labels is not None and (old_label or "").lower() != pwd.label.lower():
+			if old_label is not None:
+				others = [p for p in self._labels.pop(old_label.lower()) if p is not pwd]
+				if others:
+					self._labels[old_label.lower()] = others
+			self._labels.setdefault(pwd.label.lower(), []).append(pwd)
+		if self._positions is not None:
+			self._positions[id(pwd)] = i
+		if self._index is not None:
+			self._index.update(i, pwd.values())
+		if self._tag_index is not None:
+			self._tag_index.update(i, pwd.tags)
+		if self._reuse_index is not None:
+			self._reuse_index.update(i, pwd.password)
+		if self._host_index is not None:
+			self._host_index.update(i, pwd.url)
+
+	@property
+	def index(self) -> SearchIndex:
+		if self._index is None:
+			self._index = SearchIndex(enumerate(p.values() for p in self.passwords))
+		return self._index
+
+	@property
+	def tag_index(self) -> TagIndex:
+		if self._tag_index is None:
+			self._tag_index = TagIndex(enumerate(p.tags for p in self.passwords))
+		return self._tag_index
+
+	@property
+	def reuse_index(self) -> ReuseIndex:
+		if self._reuse_index is None:
+			self._reuse_index = ReuseIndex(enumerate(p.password for p in self.passwords))
+		return self._reuse_index
+
+	@property
+	def host_index(self) -> HostIndex:
+		if self._host_index is None:
+			self._host_index = HostIndex(enumerate(p.url for p in self.passwords))
+		return self._host_index
+
+	def get(self, label: str) -> List[Password]:
+		"""Get passwords with given label (ignoring case).
+		"""
+		return self.labels.get(label.lower(), [])
+
+	def search(self, text: str) -> List[Password]:
+		"""Get passwords having any attribute containing the text.
+		"""
+		return [self.passwords[i] for i in sorted(self.index.search(text))]
+
+	def for_site(self, url: str) -> List[Password]:
+		"""Get passwords for the site of the URL or host name, exact host first.
+		"""
+		return pwdmgr_core.find_by_host(self.passwords, url, self.host_index)
+
+	def with_tags(self, tags: List[str], match_all=True) -> List[Password]:
+		"""Get passwords having all (or any) of the given tags.
+		"""
+		return [self.passwords[i] for i in sorted(self.tag_index.search(tags, match_all))]
+
+	def reused(self) -> List[List[Password]]:
+		"""Get groups of passwords with the same secret, largest group first.
+		"""
+		return [[self.passwords[i] for i in sorted(group)] for group in self.reuse_index.groups()]
+
+	def merge(self, imported: Iterable[Password], vault: int = 0) -> Tuple[int, int, int]:
+		"""Merge imported passwords, adding new ones to the given vault (default:
+		the main one); get number of added, updated and unchanged passwords.
+		"""
+		added, updated, unchanged = pwdmgr_io.merge(self.passwords, imported)
+		self.vaults.extend([vault] * len(added))
+		for i in added:
+			self._record(vault, None, self.passwords[i])
+			self._update(i)
+		for i in updated:
+			# merged by label, username and URL, so the label is the same
+			self._record(self.vaults[i], self.passwords[i], self.passwords[i])
+			self._update(i, self.passwords[i].label)
+		return len(added), len(updated), unchanged
+
+	def set(self, label: str, values: Dict[str, str]) -> Password:
+		"""Update first password with given label, or add a new one.
+		"""
+		matches = self.get(label)
+		if matches:
+			pwd = matches[0]
+			i = self.positions[id(pwd)]
+			self._record(self.vaults[i], pwd, pwd)
+		else:
+			pwd = Password(**{att: "" for att in ATTRIBUTES})
+			pwd.label = label
+			i = len(self.passwords)
+			self.add([pwd])
+		old_label = pwd.label
+		if "password" in values and "last_changed" not in values:
+			values = {**values, "last_changed": datetime.date.today().isoformat()}
+		for att, value in values.items():
+			setattr(pwd, att, value)
+		self._update(i, old_label)
+		return pwd
+
+	def add(self, passwords: List[Password], vault: int = 0) -> int:
+		"""Add those passwords that are not already present to the given vault
+		(default: the main one); return number of added passwords.
+		"""
+		new = [p for p in passwords
+		       if not any(p.values() == q.values() for q in self.get(p.label))]
+		for p in new:
+			self.passwords.append(p)
+			self.vaults.append(vault)
+			self._record(vault, None, p)
+			self._update(len(self.passwords) - 1)
+		return len(new)
+
+
+def show(passwords: List[Password]) -> List[str]:
+	return ["\t".join((p.label, p.username, p.url)) for p in passwords]
+
+
+def cmd_get(lookup, args):
+	return [getattr(p, args.field) for p in lookup.get(args.label)]
+
+
+def cmd_search(lookup, args):
+	return show(lookup.search(args.text))
+
+
+def cmd_site(lookup, args):
+	return show(lookup.for_site(args.url))
+
+
+def cmd_list(lookup, args):
+	return show(lookup.with_tags(args.tags.split(","), not args.any) if args.tags else lookup.passwords)
+
+
+def cmd_set(lookup, args):
+	if not all("=" in v for v in args.values):
+		raise ValueError("Values must be given as field=value")
+	values = dict(v.split("=", 1) for v in args.values)
+	unknown = values.keys() - set(ATTRIBUTES)
+	if unknown:
+		raise ValueError(f"Unknown attributes: {', '.join(unknown)}")
+	return show([lookup.set(args.label, values)])
+
+
+def cmd_reused(lookup, _args):
+	return [f"{n}\t{line}" for n, group in enumerate(lookup.reused(), start=1) for line in show(group)]
+
+
+def cmd_import(lookup, args):
+	added, updated, unchanged = lookup.merge(pwdmgr_io.read(args.file, args.format))
+	return [f"imported {added} new entries, updated {updated}, {unchanged} unchanged"]
+
+
+def cmd_export(lookup, args):
+	conf = config.load_config()
+	if not args.encrypt:
+		print("Warning: writing passwords in plain text", file=sys.stderr)
+	pwdmgr_io.export(lookup.passwords, args.file, args.format, conf.usermail if args.encrypt else None)
+	return [f"exported {len(lookup.passwords)} entries"]
+
+
+def cmd_audit(lookup, args):
+	import pwdmgr_audit
+	path = args.file or config.load_config().breach_list
+	if not path:
+		raise ValueError("No list of breached password hashes given or configured")
+	found = pwdmgr_audit.audit(lookup.passwords, path)
+	breached = sorted(found)
+	lines = show([lookup.passwords[i] for i in breached])
+	return [f"{line}\t{found[i]}" for i, line in zip(breached, lines)] + \
+	       [f"{len(found)} of {len(lookup.passwords)} passwords found in breaches"]
+
+
+def cmd_batch(lookup, args):
+	for line in sys.stdin:
+		if line.strip():
+			print(json.dumps(answer(lookup, line)), flush=True)
+	return []
+
+
+def answer(lookup: Lookup, line: str) -> dict:
+	"""Answer a single query in batch mode, given as a command line.
+	"""
+	try:
+		query = get_batch_parser().parse_args(shlex.split(line))
+		return {"query": line.strip(), "result": query.command(lookup, query)}
+	except (Exception, SystemExit) as e:
+		return {"query": line.strip(), "error": str(e) or "invalid query"}
+
+
+def get_batch_parser() -> argparse.ArgumentParser:
+	"""Get the parser for single queries in batch mode, created on first use
+	and then reused, as creating it takes longer than most queries.
+	"""
+	global _batch_parser
+	if _batch_parser is None:
+		_batch_parser = create_parser(batch=True)
+	return _batch_parser
+
+
+class BatchParser(argparse.ArgumentParser):
+	"""Parser for queries in batch mode, raising errors and requests for help
+	instead of printing them and exiting, so they are answered as JSON, too.
+	"""
+
+	def error(self, message):
+		raise ValueError(f"{self.prog}: {message}")
+
+	def print_help(self, file=None):
+		raise ValueError(" ".join(self.format_usage().split()))
+
+
+def create_parser(batch=False) -> argparse.ArgumentParser:
+	"""Create parser for the command line, or for a single query in batch mode.
+	"""
+	parser_class = BatchParser if batch else argparse.ArgumentParser
+	parser = parser_class(prog="pwdmgr", description="Password Manager CLI",
+	                      exit_on_error=not batch)
+	if not batch:
+		parser.add_argument("-a", "--agent", action="store_true", dest="agent", help="Query running agent?")
+	commands = parser.add_subparsers(required=True, dest="name")
+
+	cmd = commands.add_parser("get", help="Print a field of the entry with given label")
+	cmd.add_argument("label")
+	cmd.add_argument("-f", "--field", default="password", choices=ATTRIBUTES, dest="field")
+	cmd.set_defaults(command=cmd_get)
+
+	cmd = commands.add_parser("search", help="List entries containing the given text")
+	cmd.add_argument("text")
+	cmd.set_defaults(command=cmd_search)
+
+	cmd = commands.add_parser("site", help="List entries for the site of the given URL or host name")
+	cmd.add_argument("url")
+	cmd.set_defaults(command=cmd_site)
+
+	cmd = commands.add_parser("list", help="List all entries, or those with the given tags")
+	cmd.add_argument("-t", "--tags", dest="tags", help="Comma-separated tags, all required")
+	cmd.add_argument("--any", action="store_true", help="Require any of the tags instead of all?")
+	cmd.set_defaults(command=cmd_list)
+
+	cmd = commands.add_parser("set", help="Create or update entry with given label")
+	cmd.add_argument("label")
+	cmd.add_argument("values", nargs="+", metavar="field=value")
+	cmd.set_defaults(command=cmd_set)
+
+	cmd = commands.add_parser("reused", help="List entries sharing the same password, numbered by group")
+	cmd.set_defaults(command=cmd_reused)
+
+	if not batch:
+		cmd = commands.add_parser("import", help="Add or update entries from CSV, KeePass XML, or plain JSON file")
+		cmd.add_argument("file")
+		cmd.add_argument("-f", "--format", choices=pwdmgr_io.READERS, dest="format", help="Default: file extension")
+		cmd.set_defaults(command=cmd_import)
+
+		cmd = commands.add_parser("export", help="Write all entries to CSV or JSON file")
+		cmd.add_argument("file")
+		cmd.add_argument("-f", "--format", choices=pwdmgr_io.WRITERS, default="csv", dest="format")
+		cmd.add_argument("-e", "--encrypt", action="store_true", dest="encrypt", help="Encrypt for configured e-mail?")
+		cmd.set_defaults(command=cmd_export)
+
+		cmd = commands.add_parser("audit", help="List entries whose password is in a list of breached password hashes")
+		cmd.add_argument("file", nargs="?", help="Sorted SHA-1 hashes (default: breach_list from config)")
+		cmd.set_defaults(command=cmd_audit)
+
+		cmd = commands.add_parser("batch", help="Answer queries from stdin, one per line")
+		cmd.set_defaults(command=cmd_batch)
+	return parser
+
+
+def query_agent(args):
+	"""Send the command, or the batch of queries from stdin, to the agent
+	"""
+	import pwdmgr_agent
+	if args.name == "batch":
+		lines = sys.stdin
+	else:
+		# forward the command as given, without the global options before it
+		argv = sys.argv[1:]
+		lines = [shlex.join(argv[argv.index(args.name):])]
+	with pwdmgr_agent.Client() as client:
+		for line in lines:
+			if line.strip():
+				print(json.dumps(client.query(line)), flush=True)
+
+
+def main():
+	"""Run a single command, or a batch of queries, on a single decryption
+	"""
+	args = create_parser().parse_args()
+	if args.agent:
+		return query_agent(args)
+	# keep stdout clean for the results, e.g. for use in scripts
+	with contextlib.redirect_stdout(sys.stderr):
+		conf = config.load_config()
+		lookup = Lookup.from_groups(pwdmgr_core.load_vaults(conf))
+	try:
+		for line in args.command(lookup, args):
+			print(line)
+	except Exception as e:
+		sys.exit(f"Error: {e}")
+	if lookup.modified:
+		with contextlib.redirect_stdout(sys.stderr):
+			changes = lookup.get_changes()
+			pwdmgr_core.save_vaults(conf, lookup.groups(len(conf.get_vaults())), changes.keys(), changes=changes)
+
+
+if __name__ == "__main__":
+	main()
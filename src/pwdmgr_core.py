@@ -5,39 +5,226 @@
 by Tobias Küster, 2018
 
 This module handles loading, saving, and most importantly, encrypting and
-decrypting the password files.
+decrypting the password files. Modules only needed for that (e.g. gnupg) are
+imported on first use, to keep the startup time of the UI short.
 """
 
+import codecs
+import copy
 import os
+import queue
 import shutil
-from typing import List
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, BinaryIO, Dict, Iterable, Iterator, List, Tuple, Union
 
-import gnupg
+import pwdmgr_shards
+import pwdmgr_trace
+from config import user_dir
+from pwdmgr_index import HostIndex
+from pwdmgr_model import load_from_json, iter_from_json, write_to_bytes, Configuration, Password
 
-from config import USER_DIR
-from pwdmgr_model import load_from_json, write_to_json, Configuration, Password
+if TYPE_CHECKING:
+	import gnupg
 
+TEST_MAIL = "pwdmgr-test@example.com"  # for the throwaway test keyring
+MAX_WORKERS = 8  # number of vaults to decrypt or encrypt at the same time
 
-def load_decrypt(config: Configuration) -> List[Password]:
-	"""Load and decrypt passwords from given file.
+
+class GPGSession:
+	"""Lazily created GPG handle that can be reused for many load and save
+	operations, instead of probing the gpg version and keyring each time, with
+	cached lookup of the keys to encrypt for.
+	"""
+
+	def __init__(self, gnupghome: str = None):
+		self.gnupghome = gnupghome or os.path.join(user_dir(), ".gnupg")
+		self._gpg = None
+		self._recipients = {}
+		self._lock = threading.Lock()
+
+	@property
+	def gpg(self) -> "gnupg.GPG":
+		with self._lock:
+			if self._gpg is None:
+				import gnupg
+				self._gpg = gnupg.GPG(gnupghome=self.gnupghome)
+				self._recipients = {}  # keyring may have changed in the meantime
+			return self._gpg
+
+	def handle(self) -> "gnupg.GPG":
+		"""Get a copy of the GPG handle whose attributes (e.g. on_data) can be
+		changed without affecting other users of the session.
+		"""
+		return copy.copy(self.gpg)
+
+	def recipient(self, usermail: str) -> str:
+		"""Get fingerprint of the first key for the given e-mail that is not
+		revoked, expired, invalid or disabled.
+		"""
+		if usermail not in self._recipients:
+			keys = [k for k in self.gpg.list_keys(keys=[usermail])
+			        if k["trust"] not in ("r", "e", "i", "d")]
+			if not keys:
+				raise Exception(f"No valid key found for {usermail}")
+			self._recipients[usermail] = keys[0]["fingerprint"]
+		return self._recipients[usermail]
+
+	@pwdmgr_trace.timed("gpg.decrypt")
+	def decrypt(self, filename: str) -> str:
+		"""Decrypt given file and return the plain text.
+		"""
+		with open(filename, "rb") as f:
+			crypt = self.gpg.decrypt_file(f)
+		if not crypt.ok:
+			raise Exception(crypt.status)
+		return str(crypt)
+
+	@pwdmgr_trace.timed("gpg.decrypt")
+	def decrypt_text(self, cipher: str) -> str:
+		"""Decrypt given cipher text and return the plain text.
+		"""
+		crypt = self.gpg.decrypt(cipher)
+		if not crypt.ok:
+			raise Exception(crypt.status)
+		return str(crypt)
+
+	@pwdmgr_trace.timed("gpg.encrypt")
+	def encrypt(self, plain: Union[str, bytes], usermail: str) -> str:
+		"""Encrypt plain text for given e-mail and return the cipher text.
+		"""
+		crypt = self.gpg.encrypt(plain, self.recipient(usermail), always_trust=True)
+		if not crypt.ok:
+			raise Exception(crypt.status)
+		return str(crypt)
+
+	@pwdmgr_trace.timed("gpg.encrypt")
+	def encrypt_file(self, plain: BinaryIO, usermail: str, filename: str):
+		"""Encrypt plain text read from the file object for given e-mail and
+		write the cipher text to the file, without holding either in memory.
+		"""
+		crypt = self.gpg.encrypt_file(plain, self.recipient(usermail), always_trust=True, output=filename)
+		if not crypt.ok:
+			raise Exception(crypt.status)
+
+	def launch_agent(self):
+		"""Make sure gpg-agent is running for this session's home directory,
+		so it does not have to be started by the first decryption.
+		"""
+		import subprocess
+		subprocess.run(["gpgconf", "--launch", "gpg-agent"], check=False,
+		               env={**os.environ, "GNUPGHOME": self.gnupghome})
+
+
+_session = None
+
+
+def get_session() -> GPGSession:
+	"""Get the shared GPG session for the user's default GPG home directory.
 	"""
+	global _session
+	if _session is None:
+		_session = GPGSession()
+	return _session
+
+
+@pwdmgr_trace.timed()
+def load_decrypt(config: Configuration, session: GPGSession = None) -> List[Password]:
+	"""Load and decrypt passwords from given file, in single-file or sharded
+	format; for the latter, secrets are decrypted lazily.
+	"""
+	if pwdmgr_shards.is_sharded(config):
+		return pwdmgr_shards.load(config, session or get_session())
+	if config.append_only:
+		import pwdmgr_changelog
+		return pwdmgr_changelog.load(config, session or get_session())
 	print("decrypting...")
-	gpg = gnupg.GPG(gnupghome=USER_DIR + "/.gnupg")
-	with open(config.filename, "rb") as f:
+	gpg = (session or get_session()).gpg
+	with open(config.filename, "rb") as f, pwdmgr_trace.span("gpg.decrypt"):
 		crypt = gpg.decrypt_file(f)
-		if crypt.ok:
-			return load_from_json(str(crypt))
-		else:
-			raise Exception(crypt.status)
+	if crypt.ok:
+		passwords = load_from_json(crypt.data)
+		pwdmgr_trace.count("passwords.loaded", len(passwords))
+		return passwords
+	else:
+		raise Exception(crypt.status)
 
 
-def save_encrypt(config: Configuration, passwords: List[Password]):
-	"""Encrypt and save passwords to given file.
+def stream_decrypt(config: Configuration, session: GPGSession = None) -> Iterator[Password]:
+	"""Load and decrypt passwords from given file, yielding them one by one
+	while GPG is still decrypting, instead of building the entire plain text
+	and list of passwords in memory first.
 	"""
+	if pwdmgr_shards.is_sharded(config):
+		yield from pwdmgr_shards.load(config, session or get_session())
+		return
+	if config.append_only:
+		import pwdmgr_changelog
+		yield from pwdmgr_changelog.load(config, session or get_session())
+		return
+	print("decrypting (streaming)...")
+	gpg = (session or get_session()).handle()
+	chunks = queue.Queue(maxsize=64)
+	cancelled = threading.Event()
+	result = []
+
+	def on_data(data):
+		if data and not cancelled.is_set():
+			chunks.put(data)
+		return False  # do not also collect the data in the result
+
+	def decrypt():
+		try:
+			with open(config.filename, "rb") as f:
+				result.append(gpg.decrypt_file(f))
+		except Exception as e:
+			result.append(e)
+		finally:
+			chunks.put(None)
+
+	def read_chunks():
+		decoder = codecs.getincrementaldecoder("utf-8")()
+		while (data := chunks.get()) is not None:
+			yield decoder.decode(data)
+		yield decoder.decode(b"", final=True)
+		thread.join()
+		if isinstance(result[0], Exception):
+			raise result[0]
+		if not result[0].ok:
+			raise Exception(result[0].status)
+
+	gpg.on_data = on_data
+	thread = threading.Thread(target=decrypt, daemon=True)
+	thread.start()
+	reader = read_chunks()
+	try:
+		yield from iter_from_json(reader)
+		for _ in reader:
+			pass  # consume trailing output and check the final status
+	finally:
+		# unblock the decrypting thread if the caller stopped early
+		cancelled.set()
+		while not chunks.empty():
+			chunks.get_nowait()
+
+
+@pwdmgr_trace.timed()
+def save_encrypt(config: Configuration, passwords: List[Password], session: GPGSession = None,
+                 changes: List[Tuple[Password, Password]] = None):
+	"""Encrypt and save passwords to given file, in the format it already has.
+	In append-only mode, the changes since the last load or save, as pairs of
+	old and new Password (None if added or deleted), are appended to the log.
+	"""
+	session = session or get_session()
+	if pwdmgr_shards.is_sharded(config):
+		return pwdmgr_shards.save(config, session, passwords)
+	if config.append_only:
+		import pwdmgr_changelog
+		return pwdmgr_changelog.save(config, session, passwords, changes)
 	print("ecrypting...")
-	gpg = gnupg.GPG(gnupghome=USER_DIR + "/.gnupg")
-	plain = write_to_json(passwords)
-	crypt = gpg.encrypt(plain, config.usermail, always_trust=True)
+	plain = write_to_bytes(passwords, config.json_format)
+	with pwdmgr_trace.span("gpg.encrypt"):
+		crypt = session.gpg.encrypt(plain, session.recipient(config.usermail), always_trust=True)
 	if crypt.ok:
 		if os.path.isfile(config.filename):
 			shutil.copy(config.filename, config.filename + ".bak")
@@ -47,16 +234,105 @@ def save_encrypt(config: Configuration, passwords: List[Password]):
 		raise Exception(crypt.status)
 
 
+def find_by_host(passwords: List[Password], url: str, index: HostIndex = None) -> List[Password]:
+	"""Get the passwords for the site of the given URL or host name: those for
+	exactly that host first, then those for other hosts of the same domain
+	(e.g. "login.example.com" for "example.com"). Use the given index of the
+	passwords' URLs for repeated lookups, otherwise a new one is built.
+	"""
+	if index is None:
+		index = HostIndex(enumerate(p.url for p in passwords))
+	return [passwords[i] for i in index.find(url)]
+
+
+def load_vaults(config: Configuration, session: GPGSession = None) -> List[List[Password]]:
+	"""Load and decrypt the passwords of all vaults in the configuration in
+	parallel, each GPG call being a separate process anyway; vaults whose file
+	does not exist yet are empty.
+	"""
+	vaults = config.get_vaults()
+	with ThreadPoolExecutor(max_workers=min(len(vaults), MAX_WORKERS)) as pool:
+		return list(pool.map(lambda vault: _load_or_empty(vault, session), vaults))
+
+
+def iter_vaults(config: Configuration, session: GPGSession = None) -> Iterator[Tuple[int, Password]]:
+	"""Load and decrypt passwords of all vaults, yielding them together with
+	the number of their vault; if there is just one vault, it is streamed,
+	otherwise the vaults are decrypted in parallel, but yielded in order.
+	"""
+	vaults = config.get_vaults()
+	if len(vaults) == 1:
+		for pwd in stream_decrypt(config, session):
+			yield 0, pwd
+		return
+	with ThreadPoolExecutor(max_workers=min(len(vaults), MAX_WORKERS)) as pool:
+		futures = [pool.submit(_load_or_empty, vault, session) for vault in vaults]
+		for i, future in enumerate(futures):
+			for pwd in future.result():
+				yield i, pwd
+
+
+def _load_or_empty(config: Configuration, session: GPGSession) -> List[Password]:
+	try:
+		return load_decrypt(config, session)
+	except FileNotFoundError:
+		print(f"{config.filename} not found... starting new list")
+		return []
+
+
+def save_vaults(config: Configuration, groups: List[List[Password]], changed: Iterable[int] = None,
+                session: GPGSession = None, changes: Dict[int, List[Tuple[Password, Password]]] = None):
+	"""Encrypt and save the passwords of each vault, in parallel, but only for
+	the vaults with the given numbers (default: all), i.e. those that changed;
+	the changes of each vault, if known, are used in append-only mode.
+	"""
+	vaults = config.get_vaults()
+	changed = sorted(set(range(len(vaults)) if changed is None else changed))
+	if changed:
+		with ThreadPoolExecutor(max_workers=min(len(changed), MAX_WORKERS)) as pool:
+			# list() for waiting for all saves and raising the first error
+			list(pool.map(lambda i: save_encrypt(vaults[i], groups[i], session,
+			                                     None if changes is None else changes.get(i, [])), changed))
+
+
+def create_test_session(gnupghome: str) -> GPGSession:
+	"""Create throwaway keyring in given directory, with a single key without
+	passphrase for the TEST_MAIL, and return a GPG session using it.
+	"""
+	os.chmod(gnupghome, 0o700)
+	session = GPGSession(gnupghome)
+	key_input = session.gpg.gen_key_input(name_email=TEST_MAIL, key_type="RSA",
+	                                      key_length=2048, no_protection=True)
+	if not session.gpg.gen_key(key_input):
+		raise Exception("Could not create test key")
+	return session
+
+
 def test():
-	"""Just for testing loading, saving, encrytion and decryption.
+	"""Just for testing loading, saving, encrytion and decryption, using a
+	throwaway keyring, so no input is needed.
 	"""
-	from pwdmgr_model import create_test_config, create_test_passwords
-	conf = create_test_config()
-	pwds = create_test_passwords()
-	save_encrypt(conf, pwds)
-	pwds2 = load_decrypt(conf)
-	print(pwds2)
-	assert pwds == pwds2
+	import tempfile
+	from pwdmgr_model import create_random_passwords
+	with tempfile.TemporaryDirectory() as home:
+		session = create_test_session(home)
+		conf = Configuration(TEST_MAIL, os.path.join(home, "test.gpg"))
+		pwds = create_random_passwords(20)
+		save_encrypt(conf, pwds, session)
+		pwds2 = load_decrypt(conf, session)
+		print(pwds2)
+		assert pwds == pwds2
+		pwds3 = list(stream_decrypt(conf, session))
+		assert pwds == pwds3
+
+		conf.vaults = [{"filename": os.path.join(home, f"vault{i}.gpg")} for i in range(3)]
+		groups = [pwds[:5], pwds[5:10], [], pwds[10:]]
+		save_vaults(conf, groups, session=session)
+		assert load_vaults(conf, session) == groups
+		assert [vault for vault, _ in iter_vaults(conf, session)] == [0] * 5 + [1] * 5 + [3] * 10
+		os.remove(conf.vaults[0]["filename"])
+		save_vaults(conf, groups, {3}, session)  # not vault 1, i.e. vaults[0]
+		assert not os.path.exists(conf.vaults[0]["filename"])
 
 
 # testing stuff
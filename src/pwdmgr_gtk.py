@@ -12,24 +12,32 @@ Should hopefully provide a better UX than Tkinter.
 - provides basic search/filter feature
 - highlight new/modified/deleted entries
 - filter columns to be shown
+- filter by any or all of the selected tags
+- highlight passwords found in a local list of breached passwords
+- filter passwords used for more than one entry
+- filter passwords for the site of a URL or host name
+- show passwords from several vaults (files) together, saving only changed ones
+- sort by column, by clicking on the column header
 
 TODO (small ones; bigger ones are in Github Issues)
 - scroll to newly created password (seems to be not so easy...)
-- add "undo change" button?
-- show changes on exit
-- sort by drag&drop or sort by column?
+- sort by drag&drop?
 """
 
-from collections import Counter
+import os
+import queue
+import threading
 
 import gi
 gi.require_version("Gtk", "3.0")
-from gi.repository import Gtk
+from gi.repository import GLib, GObject, Gtk
 
 import config
-import pwdgen_gtk
 import pwdmgr_core
+import pwdmgr_index
+import pwdmgr_journal
 import pwdmgr_model
+import pwdmgr_trace
 
 
 # colors indicating the status of the Passwords
@@ -38,12 +46,229 @@ COLOR_NON = None       # neutral background, depends on theme
 COLOR_NEW = "#aaffaa"  # pastel green for new entries
 COLOR_DEL = "#ffaaaa"  # pastel red for deleted entries
 COLOR_MOD = "#aaaaff"  # pastel blue for modified entries
+COLOR_BRE = "#ffcc88"  # pastel orange for unchanged, but breached entries
 COLOR_FGN = None       # neutral foreground, depends on theme
 COLOR_FGB = "#000000"  # black, for pastel background
+STATUS_COLORS = {None: COLOR_NON,
+                 pwdmgr_journal.NEW: COLOR_NEW,
+                 pwdmgr_journal.DELETED: COLOR_DEL,
+                 pwdmgr_journal.MODIFIED: COLOR_MOD}
 
-# indices for derived ID, fg- and bg-color, and deleted status
+# number of passwords to add to the table at once while loading
+LOAD_BATCH = 500
+
+# indices for derived ID, fg- and bg-color, deleted status, and vault name
+# (IDs of new entries start after those of the original passwords)
 N_ATT = len(pwdmgr_model.ATTRIBUTES)
-IDX_ID, IDX_FG, IDX_BG, IDX_DEL = N_ATT, N_ATT+1, N_ATT+2, N_ATT+3
+IDX_ID, IDX_FG, IDX_BG, IDX_DEL, IDX_VAULT = N_ATT, N_ATT+1, N_ATT+2, N_ATT+3, N_ATT+4
+IDX_TAGS = pwdmgr_model.ATTRIBUTES.index("tags")
+IDX_PWD = pwdmgr_model.ATTRIBUTES.index("password")
+IDX_URL = pwdmgr_model.ATTRIBUTES.index("url")
+COLUMN_TYPES = [GObject.TYPE_STRING] * N_ATT + [GObject.TYPE_INT, GObject.TYPE_STRING,
+                                                GObject.TYPE_STRING, GObject.TYPE_BOOLEAN,
+                                                GObject.TYPE_STRING]
+
+# initial width of the table columns; needed for fixed height mode
+COLUMN_WIDTH = 120
+
+
+class PasswordStore(GObject.Object, Gtk.TreeModel):
+	""" Table model backed directly by the Passwords, instead of copying all
+	their values into a ListStore up front; values and colors are computed only
+	when the table asks for them, i.e. for the rows currently shown. Original
+	Passwords are copied when first edited, so the change journal can still
+	compare with them. Iters hold the row ID, so they stay valid. For each
+	row, the number of the vault (i.e. password file) it belongs to is kept,
+	and the rows found in the breach list in the last audit, if any.
+
+	Sorting reorders the rows of the store itself, so the filter model on top
+	of it (and all the code converting paths and iters of the filter to the
+	store) keeps working as before. The sort keys are computed once per row
+	and column, and computed again only after the row was edited.
+	"""
+
+	def __init__(self, journal, vault_names):
+		super().__init__()
+		self.journal = journal
+		self.vault_names = vault_names
+		self.ids = []        # row IDs in order of the rows
+		self.positions = {}  # row ID -> position in table
+		self.passwords = {}  # row ID -> Password, or edited copy of original
+		self.vaults = {}     # row ID -> number of vault
+		self.breached = {}   # row ID -> number of breaches
+		self.sort_keys = {}  # column -> row ID -> sort key
+		self.stamp = id(self) & 0x7fffffff
+
+	def append(self, row_id, password, vault=0):
+		""" Add the Password as new row at the end of the table
+		"""
+		self.positions[row_id] = len(self.ids)
+		self.ids.append(row_id)
+		self.passwords[row_id] = password
+		self.vaults[row_id] = vault
+		self.row_inserted(self.get_path_of(row_id), self.create_iter(row_id))
+
+	def remove(self, row_id):
+		""" Remove the row with the given ID from the table
+		"""
+		pos = self.positions.pop(row_id)
+		del self.ids[pos]
+		del self.passwords[row_id]
+		del self.vaults[row_id]
+		self.breached.pop(row_id, None)
+		for keys in self.sort_keys.values():
+			keys.pop(row_id, None)
+		for i in range(pos, len(self.ids)):
+			self.positions[self.ids[i]] = i
+		self.row_deleted(Gtk.TreePath.new_from_indices([pos]))
+
+	def set_attribute(self, row_id, column, value):
+		""" Set attribute of the row's Password, copying it first if it is
+		one of the original Passwords, and redraw the row
+		"""
+		pwd = self.passwords[row_id]
+		if row_id < len(self.journal.original) and pwd is self.journal.original[row_id]:
+			pwd = self.passwords[row_id] = pwdmgr_model.Password(*pwd.values())
+		setattr(pwd, pwdmgr_model.ATTRIBUTES[column], value)
+		self.sort_keys.get(column, {}).pop(row_id, None)
+		if column == IDX_PWD:
+			self.breached.pop(row_id, None)
+		self.update_row(row_id)
+
+	@pwdmgr_trace.timed()
+	def sort(self, column, reverse=False):
+		""" Reorder the rows by the values of the given column, computing sort
+		keys only for rows that are new or were edited since the last sort
+		"""
+		att = pwdmgr_model.ATTRIBUTES[column]
+		keys = self.sort_keys.setdefault(column, {})
+		key_func = pwdmgr_index.sort_key(att)
+		for row_id in self.ids:
+			if row_id not in keys:
+				keys[row_id] = key_func(getattr(self.passwords[row_id], att))
+		ids = sorted(self.ids, key=keys.__getitem__, reverse=reverse)
+		new_order = [self.positions[row_id] for row_id in ids]
+		self.ids = ids
+		self.positions = {row_id: i for i, row_id in enumerate(ids)}
+		if ids:
+			self.rows_reordered(Gtk.TreePath.new(), None, new_order)
+
+	def set_breached(self, breached):
+		""" Set the rows found in the breach list, and redraw those rows and
+		the ones that were previously found
+		"""
+		old, self.breached = self.breached, breached
+		for row_id in old.keys() | breached.keys():
+			self.update_row(row_id)
+
+	def update_row(self, row_id):
+		""" Notify the table that the row's values or status changed
+		"""
+		self.row_changed(self.get_path_of(row_id), self.create_iter(row_id))
+
+	def get_row_id(self, itr):
+		return itr.user_data - 1
+
+	def get_row_id_at(self, path):
+		return self.ids[path.get_indices()[0]]
+
+	def get_path_of(self, row_id):
+		return Gtk.TreePath.new_from_indices([self.positions[row_id]])
+
+	def get_groups(self):
+		""" Get current Passwords of all rows not marked for deletion, as one
+		list per vault
+		"""
+		groups = [[] for _ in self.vault_names]
+		for row_id in self.ids:
+			if row_id not in self.journal.deleted:
+				groups[self.vaults[row_id]].append(self.passwords[row_id])
+		return groups
+
+	def get_changes(self):
+		""" Get the rows added, modified or deleted, by vault, as pairs of
+		original and current Password (None for added or deleted rows)
+		"""
+		journal = self.journal
+		changes = {}
+		for row_id in sorted((journal.added ^ journal.deleted) | journal.modified.keys()):
+			old = None if row_id in journal.added else journal.original[row_id]
+			new = None if row_id in journal.deleted else self.passwords[row_id]
+			changes.setdefault(self.vaults[row_id], []).append((old, new))
+		return changes
+
+	def create_iter(self, row_id):
+		itr = Gtk.TreeIter()
+		itr.stamp = self.stamp
+		itr.user_data = row_id + 1  # not 0, which would be NULL
+		return itr
+
+	# implementation of the Gtk.TreeModel interface for a flat list
+
+	def do_get_flags(self):
+		return Gtk.TreeModelFlags.LIST_ONLY | Gtk.TreeModelFlags.ITERS_PERSIST
+
+	def do_get_n_columns(self):
+		return len(COLUMN_TYPES)
+
+	def do_get_column_type(self, column):
+		return COLUMN_TYPES[column]
+
+	def do_get_iter(self, path):
+		pos = path.get_indices()[0]
+		if pos < len(self.ids):
+			return True, self.create_iter(self.ids[pos])
+		return False, None
+
+	def do_get_path(self, itr):
+		return self.get_path_of(self.get_row_id(itr))
+
+	def do_get_value(self, itr, column):
+		row_id = self.get_row_id(itr)
+		if column < N_ATT:
+			return getattr(self.passwords[row_id], pwdmgr_model.ATTRIBUTES[column])
+		if column == IDX_ID:
+			return row_id
+		if column == IDX_VAULT:
+			return self.vault_names[self.vaults[row_id]]
+		status = self.journal.status(row_id)
+		if column == IDX_BG:
+			return COLOR_BRE if status is None and row_id in self.breached else STATUS_COLORS[status]
+		if column == IDX_FG:
+			return COLOR_FGN if status is None and row_id not in self.breached else COLOR_FGB
+		return status == pwdmgr_journal.DELETED
+
+	def do_iter_next(self, itr):
+		# iter is updated in place
+		pos = self.positions[self.get_row_id(itr)] + 1
+		if pos < len(self.ids):
+			itr.user_data = self.ids[pos] + 1
+			return True
+		return False
+
+	def do_iter_previous(self, itr):
+		pos = self.positions[self.get_row_id(itr)] - 1
+		if pos >= 0:
+			itr.user_data = self.ids[pos] + 1
+			return True
+		return False
+
+	def do_iter_children(self, parent):
+		return self.do_iter_nth_child(parent, 0)
+
+	def do_iter_has_child(self, _itr):
+		return False
+
+	def do_iter_n_children(self, itr):
+		return len(self.ids) if itr is None else 0
+
+	def do_iter_nth_child(self, parent, n):
+		if parent is None and n < len(self.ids):
+			return True, self.create_iter(self.ids[n])
+		return False, None
+
+	def do_iter_parent(self, _child):
+		return False, None
 
 
 class PwdMgrFrame:
@@ -51,31 +276,47 @@ class PwdMgrFrame:
 	a subclass of Window), including callback methods for different actions.
 	"""
 
-	def __init__(self, conf):
-		""" Create Password Manager window for given config
+	def __init__(self, conf, passwords=None):
+		""" Create Password Manager window for given config; passwords are
+		loaded in the background after the window is shown, or the given ones
+		are shown instead (e.g. for benchmarks)
 		"""
 		self.conf = conf
-		try:
-			self.original_passwords = pwdmgr_core.load_decrypt(self.conf)
-		except FileNotFoundError:
-			print("File not found... starting new list")
-			self.original_passwords = []
+		self.original_passwords = []
+		self.next_id = 0
+		self.loading = False
 
 		# create search and filtering widgets
 		self.search = Gtk.SearchEntry()
 		self.search.connect("search-changed", self.do_filter)
+		self.by_site = Gtk.CheckButton(label="By Site")
+		self.by_site.set_tooltip_text("Show entries for the site of the URL or host name entered")
+		self.by_site.connect("toggled", self.do_filter)
 		self.mod_only = Gtk.CheckButton(label="Modified Only")
 		self.mod_only.set_active(False)
-		self.mod_only.connect("toggled", self.do_filter)
+		self.mod_only.connect("toggled", self.do_filter_modified)
+		self.reused_only = Gtk.CheckButton(label="Reused Only")
+		self.reused_only.set_active(False)
+		self.reused_only.connect("toggled", self.do_filter_modified)
+
+		# create progress bar, shown while loading or saving
+		self.progress = Gtk.ProgressBar(show_text=True)
+		self.progress.set_no_show_all(True)
+		self.progress_timer = None
+		self.saving = False
 
 		# create tool bar and buttons
-		header = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+		header = self.header = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
 		header.pack_start(Gtk.Label(label="Filter"), False, False, 10)
 		header.pack_start(self.search, False, False, 0)
+		header.pack_start(self.by_site, False, False, 10)
 		header.pack_start(self.mod_only, False, False, 10)
+		header.pack_start(self.reused_only, False, False, 0)
 		header.pack_start(create_button("Select Columns", self.do_filter_columns, is_icon=False), False, False, 0)
 		header.pack_start(create_button("Tags", self.do_filter_tags, is_icon=False), False, False, 0)
 		header.pack_start(create_button("Password Generator", self.do_genpwd, is_icon=False), False, False, 0)
+		header.pack_start(create_button("Audit", self.do_audit, is_icon=False), False, False, 0)
+		header.pack_end(create_button("edit-undo", self.do_undo, "Undo last Change"), False, False, 0)
 		header.pack_end(create_button("list-remove", self.do_remove, "Mark selected for Removal"), False, False, 0)
 		header.pack_end(create_button("list-add", self.do_add, "Add new Entry"), False, False, 0)
 
@@ -88,15 +329,96 @@ class PwdMgrFrame:
 
 		body = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
 		body.pack_start(header, False, False, 0)
+		body.pack_start(self.progress, False, False, 0)
 		body.pack_start(table_scroller, True, True, 0)
 
 		# put it all together in a window
-		self.window = Gtk.ApplicationWindow(title=f"Password Manager - {conf.filename}")
+		n_vaults = len(conf.get_vaults())
+		self.window = Gtk.ApplicationWindow(title=f"Password Manager - {conf.filename}"
+		                                          + (f" (+{n_vaults - 1} vaults)" if n_vaults > 1 else ""))
 		self.window.resize(800, 600)
 		self.window.connect("delete-event", self.do_close)
 		self.window.connect("destroy", Gtk.main_quit)
 		self.window.add(body)
 		self.window.show_all()
+		self.start_load(passwords)
+
+	def start_load(self, passwords=None):
+		""" Start loading passwords on a worker thread, while showing progress
+		"""
+		self.set_busy("Loading...")
+		self.loading = True
+		threading.Thread(target=self.load_worker, args=(passwords,), daemon=True).start()
+
+	def load_worker(self, passwords):
+		""" Loading thread; decrypt passwords and add them to the search index
+		as they come in, and hand them over to the main loop in batches
+		"""
+		batch = []
+		entries = ((0, p) for p in passwords) if passwords is not None else pwdmgr_core.iter_vaults(self.conf)
+		try:
+			with pwdmgr_trace.span("PwdMgrFrame.load_worker"):
+				for i, (vault, entry) in enumerate(entries):
+					self.index.add(i, entry.values())
+					self.tag_index.add(i, entry.tags)
+					self.reuse_index.add(i, entry.password)
+					self.host_index.add(i, entry.url)
+					batch.append((vault, entry))
+					if len(batch) == LOAD_BATCH:
+						GLib.idle_add(self.add_loaded, batch)
+						batch = []
+			GLib.idle_add(self.add_loaded, batch)
+			GLib.idle_add(self.load_finished, None)
+		except FileNotFoundError:
+			print("File not found... starting new list")
+			GLib.idle_add(self.load_finished, None)
+		except Exception as e:
+			GLib.idle_add(self.load_finished, e)
+
+	@pwdmgr_trace.timed()
+	def add_loaded(self, batch):
+		""" Called on the main loop for adding a batch of loaded passwords
+		"""
+		for vault, entry in batch:
+			self.store.append(len(self.original_passwords), entry, vault)
+			self.original_passwords.append(entry)
+		pwdmgr_trace.count("rows.loaded", len(batch))
+		self.progress.set_text(f"Loading... ({len(self.original_passwords)} entries)")
+		return False
+
+	def load_finished(self, error):
+		""" Called on the main loop when loading is done; in case of an error,
+		close without saving, so the password file is not overwritten
+		"""
+		self.loading = False
+		if error is not None:
+			show_error(self.window, f"Decryption failed:\n{error}")
+			self.window.destroy()
+		else:
+			self.next_id = len(self.original_passwords)
+			self.set_busy(None)
+		return False
+
+	def set_busy(self, text):
+		""" Show progress bar with given text and lock the controls while loading
+		or saving, or hide it and unlock the controls again if text is None
+		"""
+		busy = text is not None
+		self.header.set_sensitive(not busy)
+		self.table.set_sensitive(not busy)
+		self.progress.set_visible(busy)
+		self.progress.set_text(text)
+		if busy and self.progress_timer is None:
+			self.progress_timer = GLib.timeout_add(100, self.pulse)
+		if not busy and self.progress_timer is not None:
+			GLib.source_remove(self.progress_timer)
+			self.progress_timer = None
+
+	def pulse(self):
+		""" Timer callback for animating the progress bar
+		"""
+		self.progress.pulse()
+		return True
 
 	def do_filter_columns(self, widget):
 		""" Callback for showing the column-filter menu; not the actual buttons
@@ -113,37 +435,114 @@ class PwdMgrFrame:
 		tag_menu.show_all()
 
 	def do_filter(self, _widget):
-		""" Callback for filtering; basically just delegate to the actual filter
+		""" Callback for search field; (re)start the timer for filtering, so
+		that keystrokes in quick succession are coalesced to a single query
 		"""
-		print("filtering...", self.search.get_text(), self.mod_only.get_active())
-		self.store_filter.refilter()
+		self.filter_gen += 1
+		if self.filter_timer is not None:
+			GLib.source_remove(self.filter_timer)
+		self.filter_timer = GLib.timeout_add(self.conf.filter_delay, self.start_filter, self.filter_gen)
+
+	def do_filter_modified(self, _widget):
+		""" Callback for modified-only and reused-only filters; matches do not
+		change, so just delegate to the actual filter
+		"""
+		self.refilter()
+
+	def start_filter(self, gen):
+		""" Called by the timer when the user stopped typing; hand query over
+		to the filter thread
+		"""
+		self.filter_timer = None
+		self.edited_rows.clear()
+		index = self.host_index if self.by_site.get_active() else self.index
+		self.filter_queue.put((gen, index, self.search.get_text()))
+		return False
+
+	def filter_worker(self):
+		""" Filter thread, looking up the matching rows in the search index, or
+		in the host index when filtering by site; queries superseded by newer
+		input are skipped, or their results dropped
+		"""
+		while True:
+			gen, index, text = self.filter_queue.get()
+			if gen == self.filter_gen:
+				with pwdmgr_trace.span(f"{type(index).__name__}.search"):
+					matches = index.search(text) if text else None
+				GLib.idle_add(self.apply_filter, gen, index, text, matches)
+
+	def apply_filter(self, gen, index, text, matches):
+		""" Called on the main loop with the rows matching the query, if still
+		current; update rows edited in the meantime, then refilter the table
+		"""
+		if gen == self.filter_gen:
+			self.query_index, self.query, self.matches = index, text, matches
+			for row_id in self.edited_rows:
+				self.update_matches(row_id)
+			pwdmgr_trace.count("filter.queries")
+			self.refilter()
+		return False
 
 	def do_close(self, *_args):
 		""" Callback for Close-button; check whether there are changes, if so
-		update passwords and save file (save_encrypt creates backup)
+		update passwords and save file in the background (save_encrypt creates
+		backup) and keep the window open until that is done
 		"""
-		new_passwords = [pwdmgr_model.Password(*vals[:N_ATT])
-		                 for vals in self.store if not vals[IDX_DEL]]
-		if new_passwords != self.original_passwords:
-			if ask_dialog(self.window, "Save Changes?", "Select 'No' to review changes"):
+		if self.saving:
+			return True
+		if self.loading:
+			return False  # nothing changed yet
+		if self.journal.is_dirty():
+			if ask_dialog(self.window, "Save Changes?",
+					f"{self.journal.summary()}\nSelect 'No' to review changes"):
 				print("saving...")
-				try:
-					pwdmgr_core.save_encrypt(self.conf, new_passwords)
-					return False
-				except Exception as e:
-					return not ask_dialog(self.window, f"Encryption failed:\n{e}\nExit Anyway?")
+				groups, changes = self.store.get_groups(), self.store.get_changes()
+				self.set_busy("Saving...")
+				self.saving = True
+				threading.Thread(target=self.save_worker, args=(groups, changes), daemon=True).start()
+				return True
 			else:
 				return not ask_dialog(self.window, "Exit Anyway?")
 		return False
 
+	def save_worker(self, groups, changes):
+		""" Saving thread; encrypt and save passwords of the changed vaults,
+		then report back
+		"""
+		try:
+			pwdmgr_core.save_vaults(self.conf, groups, changes.keys(), changes=changes)
+			GLib.idle_add(self.save_finished, None)
+		except Exception as e:
+			GLib.idle_add(self.save_finished, e)
+
+	def save_finished(self, error):
+		""" Called on the main loop when saving is done; close the window, or
+		ask whether to close anyway if saving failed
+		"""
+		self.set_busy(None)
+		self.saving = False
+		if error is None or ask_dialog(self.window, f"Encryption failed:\n{error}\nExit Anyway?"):
+			self.window.destroy()
+		return False
+
 	def do_add(self, _widget):
-		""" Callback for creating a new Password entry
+		""" Callback for creating a new Password entry, in the same vault as
+		the selected entry, if any, or in the main password file
 		"""
 		if ask_dialog(self.window, "Add Password"):
 			print("adding password")
-			vals = [*pwdmgr_model.ATTRIBUTES, -1, None, None, False]
-			self.set_color(vals)
-			self.store.append(vals)
+			_, itr = self.select.get_selected()
+			vault = 0 if itr is None else \
+			        self.store.vaults[self.store.get_row_id(self.store_filter.convert_iter_to_child_iter(itr))]
+			row_id = self.next_id
+			self.next_id += 1
+			self.index.add(row_id, pwdmgr_model.ATTRIBUTES)
+			self.tag_index.add(row_id, "tags")
+			# not in reuse index until the user sets an actual password
+			self.host_index.add(row_id, "url")
+			self.update_matches(row_id)
+			self.journal.add(row_id)
+			self.store.append(row_id, pwdmgr_model.Password(*pwdmgr_model.ATTRIBUTES), vault)
 
 	def do_remove(self, _widget):
 		""" Callback for removing the selected Password entry
@@ -152,25 +551,109 @@ class PwdMgrFrame:
 		if itr is not None and ask_dialog(self.window, "Delete Selected?",
 				"Mark/unmark selected password for deletion?"):
 			print("setting delete mark")
-			itr = self.store_filter.convert_iter_to_child_iter(itr)
-			vals = self.store[itr]
-			vals[IDX_DEL] ^= True
-			self.set_color(vals)
+			row_id = self.store.get_row_id(self.store_filter.convert_iter_to_child_iter(itr))
+			self.journal.toggle_delete(row_id)
+			self.store.update_row(row_id)
+
+	def do_undo(self, _widget):
+		""" Callback for undoing the last change recorded in the journal
+		"""
+		op = self.journal.undo()
+		if op is None:
+			return
+		print("undoing", op[0])
+		kind, row_id = op[:2]
+		if kind == "add":
+			self.index.remove(row_id)
+			self.tag_index.remove(row_id)
+			self.reuse_index.remove(row_id)
+			self.host_index.remove(row_id)
+			self.store.remove(row_id)
+		elif kind == "delete":
+			self.store.update_row(row_id)
+		elif kind == "modify":
+			self.update_value(row_id, *op[2:])
 
 	def do_genpwd(self, _widget):
 		"""Show Password Generator
 		"""
+		import pwdgen_gtk  # only loaded when first needed, for faster startup
 		pwdgen_gtk.PwdGenFrame(is_main=False)
 
+	def do_sort(self, column, index):
+		""" Callback for sorting by the clicked column, ascending on the first
+		click, then toggling between descending and ascending
+		"""
+		descending = column.get_sort_indicator() and column.get_sort_order() == Gtk.SortType.ASCENDING
+		for other in self.table.get_columns():
+			other.set_sort_indicator(other is column)
+		column.set_sort_order(Gtk.SortType.DESCENDING if descending else Gtk.SortType.ASCENDING)
+		self.store.sort(index, descending)
+
+	def do_audit(self, _widget):
+		""" Callback for checking the current passwords against the configured
+		list of breached passwords, or a list selected by the user
+		"""
+		path = self.conf.breach_list or choose_file(self.window, "Select List of Breached Password Hashes")
+		if path:
+			row_ids = list(self.store.ids)
+			passwords = [self.store.passwords[row_id] for row_id in row_ids]
+			self.set_busy("Checking passwords...")
+			threading.Thread(target=self.audit_worker, args=(path, row_ids, passwords), daemon=True).start()
+
+	def audit_worker(self, path, row_ids, passwords):
+		""" Audit thread; look up the passwords in the breach list, then
+		report back
+		"""
+		import pwdmgr_audit
+		try:
+			with pwdmgr_trace.span("PwdMgrFrame.audit_worker"):
+				found = pwdmgr_audit.audit(passwords, path)
+			GLib.idle_add(self.audit_finished, {row_ids[i]: n for i, n in found.items()}, None)
+		except Exception as e:
+			GLib.idle_add(self.audit_finished, None, e)
+
+	def audit_finished(self, breached, error):
+		""" Called on the main loop when the audit is done; highlight the rows
+		of the breached passwords
+		"""
+		self.set_busy(None)
+		if error is not None:
+			show_error(self.window, "Audit failed", str(error))
+		else:
+			self.store.set_breached(breached)
+			show_info(self.window, f"{len(breached)} of {len(self.store.ids)} passwords found in breaches",
+			          "Those are highlighted until their password is changed.")
+		return False
+
+	@pwdmgr_trace.timed()
+	def refilter(self):
+		self.store_filter.refilter()
+
+	@pwdmgr_trace.timed()
 	def filter_func(self, model, itr, _data):
 		""" Callback called for each row in the table to determine whether it
 		should be shown or hidden
 		"""
-		vals = model[itr]
-		if self.mod_only.get_active() and vals[IDX_BG] == COLOR_NON:
+		row_id = model.get_row_id(itr)
+		if self.mod_only.get_active() and self.journal.status(row_id) is None:
 			return False
-		text = self.search.get_text().lower()
-		return any(text in att.lower() for att in vals[:N_ATT])
+		if self.tag_matches is not None and row_id not in self.tag_matches:
+			return False
+		if self.reused_only.get_active() and row_id not in self.reuse_index.reused:
+			return False
+		return self.matches is None or row_id in self.matches
+
+	def update_matches(self, row_id):
+		""" Update the set of rows matching the current search after a row has
+		been added or changed, without searching all the rows again
+		"""
+		self.edited_rows.add(row_id)
+		if self.matches is not None:
+			if self.query_index.matches(row_id, self.query):
+				self.matches.add(row_id)
+			else:
+				self.matches.discard(row_id)
 
 	def create_edit_func(self, column):
 		""" Helper function for creating edit-callbacks for each column
@@ -179,20 +662,50 @@ class PwdMgrFrame:
 			# get unfiltered path or Exception if edit removes row from filter
 			path = Gtk.TreePath.new_from_string(path)
 			path = self.store_filter.convert_path_to_child_path(path)
-			values = self.store[path]
-			values[column] = text
-			self.set_color(values)
+			row_id = self.store.get_row_id_at(path)
+			old = getattr(self.store.passwords[row_id], pwdmgr_model.ATTRIBUTES[column])
+			if old != text:
+				self.journal.modify(row_id, column, old, text)
+				self.update_value(row_id, column, text)
 		return edit_func
 
+	def update_value(self, row_id, column, text):
+		""" Helper function for setting a value in the table after an edit or
+		undo, updating the search index and the row's color
+		"""
+		values = self.store.passwords[row_id].values()
+		values[column] = text
+		self.index.update(row_id, values)
+		if column == IDX_URL:
+			self.host_index.update(row_id, text)
+		self.update_matches(row_id)
+		if column == IDX_TAGS:
+			self.tag_index.update(row_id, text)
+			self.update_tag_matches()
+		self.store.set_attribute(row_id, column, text)
+		if column == IDX_PWD:
+			# may also change whether other rows are reused, i.e. shown
+			self.reuse_index.update(row_id, text)
+			if self.reused_only.get_active():
+				self.refilter()
+
+	@pwdmgr_trace.timed()
 	def create_model(self):
-		""" Create list model and filter model and populate with Passwords
+		""" Create list model and filter model, to be populated with Passwords
 		data format: [main Password attributes, index / ID, Color, Deleted?]
 		"""
-		self.store = Gtk.ListStore(*[str]*8 + [int, str, str, bool])
-		for i, entry in enumerate(self.original_passwords):
-			vals = [*entry.values(), i, None, None, False]
-			self.set_color(vals)
-			self.store.append(vals)
+		self.journal = pwdmgr_journal.ChangeJournal(self.original_passwords)
+		self.store = PasswordStore(self.journal, [os.path.basename(vault.filename)
+		                                          for vault in self.conf.get_vaults()])
+		self.index = pwdmgr_index.SearchIndex()
+		self.tag_index = pwdmgr_index.TagIndex()
+		self.reuse_index = pwdmgr_index.ReuseIndex()
+		self.host_index = pwdmgr_index.HostIndex()
+		self.selected_tags, self.match_all_tags, self.tag_matches = set(), True, None
+		self.query_index, self.query, self.matches = self.index, "", None
+		self.filter_gen, self.filter_timer, self.edited_rows = 0, None, set()
+		self.filter_queue = queue.Queue()
+		threading.Thread(target=self.filter_worker, daemon=True).start()
 		self.store_filter = self.store.filter_new()
 		self.store_filter.set_visible_func(self.filter_func)
 
@@ -208,8 +721,19 @@ class PwdMgrFrame:
 			renderer = Gtk.CellRendererText()
 			renderer.set_property("editable", True)
 			renderer.connect("edited", self.create_edit_func(i))
-			table.append_column(Gtk.TreeViewColumn(att, renderer, text=i, foreground=IDX_FG, background=IDX_BG))
-
+			column = Gtk.TreeViewColumn(att, renderer, text=i, foreground=IDX_FG, background=IDX_BG)
+			column.set_clickable(True)
+			column.connect("clicked", self.do_sort, i)
+			table.append_column(column)
+		if len(self.store.vault_names) > 1:
+			table.append_column(Gtk.TreeViewColumn("vault", Gtk.CellRendererText(), text=IDX_VAULT, foreground=IDX_FG, background=IDX_BG))
+
+		# all rows have the same height, so values are only needed for shown rows
+		for column in table.get_columns():
+			column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+			column.set_fixed_width(COLUMN_WIDTH // 2 if column.get_title() == "id" else COLUMN_WIDTH)
+			column.set_resizable(True)
+		table.set_fixed_height_mode(True)
 		return table
 
 	def create_column_menu(self):
@@ -237,31 +761,45 @@ class PwdMgrFrame:
 		return menu
 
 	def create_tags_menu(self):
-		""" Create Popover menu with buttons for filtering by tags
+		""" Create Popover menu with checkbox buttons for filtering by tags,
+		showing the number of entries per tag, as kept in the tag index
 		"""
+		match_all = Gtk.CheckButton(label="Match all Tags")
+		match_all.set_active(self.match_all_tags)
+		def toggled_all(button):
+			self.match_all_tags = button.get_active()
+			self.update_tag_matches()
+			self.refilter()
+		match_all.connect("toggled", toggled_all)
+
 		grid = Gtk.Grid()
-		idx_tags = pwdmgr_model.ATTRIBUTES.index("tags")
-		tags = Counter(tag.strip() for vals in self.store for tag in vals[idx_tags].split(","))
-		for i, (tag, count) in enumerate(sorted(tags.most_common())):
-			def clicked(*_args, tag=tag):
-				self.search.set_text(tag)
-			button = create_button(f"{tag} ({count})", clicked, is_icon=False)
+		# selected tags no longer used are still shown, so they can be deselected
+		counts = {tag: 0 for tag in self.selected_tags}
+		counts.update(self.tag_index.counts())
+		for i, (tag, count) in enumerate(sorted(counts.items())):
+			button = Gtk.CheckButton.new_with_label(f"{tag} ({count})")
+			button.set_active(tag in self.selected_tags)
+			def toggled(button, tag=tag):
+				self.selected_tags ^= {tag}
+				self.update_tag_matches()
+				self.refilter()
+			button.connect("toggled", toggled)
 			grid.attach(button, i // 10, i % 10, 1, 1)
 
+		vbox = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+		vbox.pack_start(match_all, False, True, 10)
+		vbox.pack_start(grid, False, True, 0)
 		menu = Gtk.Popover()
-		menu.add(grid)
+		menu.add(vbox)
 		menu.set_position(Gtk.PositionType.BOTTOM)
 		return menu
 
-	def set_color(self, values):
-		""" Set row color depending on whether the Password is marked for
-		deletion, newly created, modified, or none of all that.
+	def update_tag_matches(self):
+		""" Update the set of rows having the selected tags, e.g. after a tag
+		was (de)selected or the tags of a row were edited
 		"""
-		values[IDX_BG] = (COLOR_DEL if values[IDX_DEL]
-		              else COLOR_NEW if values[IDX_ID] == -1
-		              else COLOR_MOD if values[:N_ATT] != self.original_passwords[values[IDX_ID]].values()
-		              else COLOR_NON)
-		values[IDX_FG] = COLOR_FGN if values[IDX_BG] == COLOR_NON else COLOR_FGB
+		self.tag_matches = (self.tag_index.search(self.selected_tags, self.match_all_tags)
+		                    if self.selected_tags else None)
 
 
 def create_button(title, command, tooltip=None, is_icon=True):
@@ -275,6 +813,38 @@ def create_button(title, command, tooltip=None, is_icon=True):
 	return button
 
 
+def show_error(parent, title, message=None):
+	""" Helper method for showing a simple error message
+	"""
+	dialog = Gtk.MessageDialog(parent=parent, flags=0,
+		message_type=Gtk.MessageType.ERROR,
+		buttons=Gtk.ButtonsType.OK, text=title)
+	dialog.format_secondary_text(message)
+	dialog.run()
+	dialog.destroy()
+
+
+def show_info(parent, title, message=None):
+	""" Helper method for showing a simple information message
+	"""
+	dialog = Gtk.MessageDialog(parent=parent, flags=0,
+		message_type=Gtk.MessageType.INFO,
+		buttons=Gtk.ButtonsType.OK, text=title)
+	dialog.format_secondary_text(message)
+	dialog.run()
+	dialog.destroy()
+
+
+def choose_file(parent, title):
+	""" Helper method for selecting an existing file; returns its path or None
+	"""
+	dialog = Gtk.FileChooserDialog(title=title, parent=parent, action=Gtk.FileChooserAction.OPEN)
+	dialog.add_buttons(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL, Gtk.STOCK_OPEN, Gtk.ResponseType.OK)
+	path = dialog.get_filename() if dialog.run() == Gtk.ResponseType.OK else None
+	dialog.destroy()
+	return path
+
+
 def ask_dialog(parent, title, message=None):
 	""" Helper method for opening a simple yes/no dialog and getting the answer
 	"""
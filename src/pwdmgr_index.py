@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+"""Search index for simple Password Manager.
+
+Inverted trigram index over the attributes of the passwords, for answering
+substring queries without having to look at each and every password, plus
+helper functions for building the index. Also, an index of the passwords' tags
+for filtering by whole tags and for showing how often each tag is used, an
+index of passwords used for more than one entry, and an index of the hosts in
+the passwords' URLs, for finding the passwords for a site.
+
+Both the indexed values and the queries are normalized to search keys, case-
+folded and without accents, so that e.g. "strasse" finds "Straße", and "creme"
+finds "Crème". The key of each password is computed only once, when it is
+added or updated, and the query only once per search, not once per password.
+Similarly, there are functions for getting keys for sorting by an attribute,
+e.g. in natural order for labels, or by date for the date of the last change.
+"""
+
+import datetime
+import hmac
+import re
+import secrets
+import threading
+import unicodedata
+from collections import defaultdict
+from typing import Callable, Dict, Hashable, Iterable, List, Set, Tuple
+
+from pwdmgr_url import normalize_host, registrable_domain
+
+N_GRAM = 3
+SEPARATOR = "\0"  # not part of any query, so no matches across attributes
+DATE_FORMATS = ("%d.%m.%Y", "%Y/%m/%d", "%d/%m/%Y", "%Y-%m", "%Y")  # besides ISO format
+
+
+class SearchIndex:
+	"""Trigram index mapping n-grams of the normalized attribute values to the
+	keys (e.g. row IDs) of the passwords containing them. Candidates found in
+	the index are verified against the indexed text, so results are exact.
+	The index may be searched from a different thread than it is updated in.
+	"""
+
+	def __init__(self, entries: Iterable[Tuple[Hashable, List[str]]] = ()):
+		self.texts = {}
+		self.grams = defaultdict(set)
+		self.lock = threading.RLock()
+		for key, values in entries:
+			self.add(key, values)
+
+	def add(self, key: Hashable, values: List[str]):
+		"""Add password attribute values under given key to the index.
+		"""
+		text = SEPARATOR.join(map(search_key, values))
+		with self.lock:
+			self.texts[key] = text
+			for gram in ngrams(text):
+				self.grams[gram].add(key)
+
+	def remove(self, key: Hashable):
+		"""Remove the values stored under given key from the index.
+		"""
+		with self.lock:
+			text = self.texts.pop(key)
+			for gram in ngrams(text):
+				keys = self.grams[gram]
+				keys.discard(key)
+				if not keys:
+					del self.grams[gram]
+
+	def update(self, key: Hashable, values: List[str]):
+		"""Replace the values stored under given key, e.g. after an edit.
+		"""
+		with self.lock:
+			if key in self.texts:
+				self.remove(key)
+			self.add(key, values)
+
+	def matches(self, key: Hashable, query: str) -> bool:
+		"""Check whether the values stored under given key match the query.
+		"""
+		query = search_key(query)
+		return SEPARATOR not in query and query in self.texts[key]
+
+	def search(self, query: str) -> Set[Hashable]:
+		"""Get keys of all entries having an attribute containing the query.
+		"""
+		query = search_key(query)
+		if SEPARATOR in query:
+			return set()
+		with self.lock:
+			if len(query) < N_GRAM:
+				candidates = self.texts
+			else:
+				# rarest n-gram is selective enough; the rest is verified below
+				candidates = min((self.grams.get(gram, ()) for gram in ngrams(query)), key=len)
+			texts = self.texts
+			return {key for key in candidates if query in texts[key]}
+
+
+class TagIndex:
+	"""Index mapping normalized tags to the keys of the passwords having them;
+	the number of passwords per tag is just the size of those sets. Tags are
+	matched as a whole, so "work" does not match "homework". As the search
+	index, this may be searched from a different thread than it is updated in.
+	"""
+
+	def __init__(self, entries: Iterable[Tuple[Hashable, str]] = ()):
+		self.tags = {}
+		self.keys = defaultdict(set)
+		self.lock = threading.RLock()
+		for key, tags in entries:
+			self.add(key, tags)
+
+	def add(self, key: Hashable, tags: str):
+		"""Add comma-separated tags of a password under given key.
+		"""
+		with self.lock:
+			self.tags[key] = split_tags(tags)
+			for tag in self.tags[key]:
+				self.keys[tag].add(key)
+
+	def remove(self, key: Hashable):
+		"""Remove the tags stored under given key from the index.
+		"""
+		with self.lock:
+			for tag in self.tags.pop(key):
+				keys = self.keys[tag]
+				keys.discard(key)
+				if not keys:
+					del self.keys[tag]
+
+	def update(self, key: Hashable, tags: str):
+		"""Replace the tags stored under given key, e.g. after an edit.
+		"""
+		with self.lock:
+			if key in self.tags:
+				self.remove(key)
+			self.add(key, tags)
+
+	def counts(self) -> Dict[str, int]:
+		"""Get number of passwords having each tag, sorted by tag.
+		"""
+		with self.lock:
+			return {tag: len(self.keys[tag]) for tag in sorted(self.keys)}
+
+	def search(self, tags: Iterable[str], match_all: bool = True) -> Set[Hashable]:
+		"""Get keys of entries having all (or any) of the given tags.
+		"""
+		tags = {normalize_tag(tag) for tag in tags} - {""}
+		with self.lock:
+			sets = sorted((self.keys.get(tag, set()) for tag in tags), key=len)
+			if not sets:
+				return set()
+			if match_all:
+				return set(sets[0]).intersection(*sets[1:])
+			return set().union(*sets)
+
+
+class ReuseIndex:
+	"""Index grouping the keys of passwords with the same secret, by a keyed
+	hash (HMAC) of the secret, so the index itself holds no copies of the
+	passwords. The key is random and only used for this index, so the hashes
+	can not be compared to those of other sessions or to lists of known
+	hashes. Empty passwords are not indexed. As the other indexes, this may be
+	searched from a different thread than it is updated in.
+	"""
+
+	def __init__(self, entries: Iterable[Tuple[Hashable, str]] = ()):
+		self.secret = secrets.token_bytes(32)
+		self.digests = {}
+		self.keys = defaultdict(set)
+		self.reused = set()  # keys of passwords used more than once
+		self.lock = threading.RLock()
+		for key, password in entries:
+			self.add(key, password)
+
+	def add(self, key: Hashable, password: str):
+		"""Add password under given key to the index.
+		"""
+		if not password:
+			return
+		digest = hmac.digest(self.secret, password.encode("utf-8"), "sha256")
+		with self.lock:
+			self.digests[key] = digest
+			keys = self.keys[digest]
+			keys.add(key)
+			if len(keys) > 1:
+				self.reused.update(keys)
+
+	def remove(self, key: Hashable):
+		"""Remove the password stored under given key from the index.
+		"""
+		with self.lock:
+			digest = self.digests.pop(key, None)
+			if digest is None:
+				return
+			keys = self.keys[digest]
+			keys.discard(key)
+			self.reused.discard(key)
+			if len(keys) == 1:
+				self.reused.difference_update(keys)
+			if not keys:
+				del self.keys[digest]
+
+	def update(self, key: Hashable, password: str):
+		"""Replace the password stored under given key, e.g. after an edit.
+		"""
+		with self.lock:
+			self.remove(key)
+			self.add(key, password)
+
+	def groups(self) -> List[Set[Hashable]]:
+		"""Get groups of keys of passwords used more than once, largest first.
+		"""
+		with self.lock:
+			return sorted((set(keys) for keys in self.keys.values() if len(keys) > 1),
+			              key=len, reverse=True)
+
+
+class HostIndex:
+	"""Index mapping the host names in the URLs of the passwords, and their
+	registrable domains (e.g. "example.co.uk" for "login.example.co.uk"), to
+	the keys of the passwords, for finding the passwords for a site without
+	looking at all of them. As the other indexes, this may be searched from a
+	different thread than it is updated in.
+	"""
+
+	def __init__(self, entries: Iterable[Tuple[Hashable, str]] = ()):
+		self.hosts = {}
+		self.by_host = defaultdict(set)
+		self.by_domain = defaultdict(set)
+		self.lock = threading.RLock()
+		for key, url in entries:
+			self.add(key, url)
+
+	def add(self, key: Hashable, url: str):
+		"""Add the host of the password's URL under given key.
+		"""
+		host = normalize_host(url)
+		if not host:
+			return
+		with self.lock:
+			self.hosts[key] = host
+			self.by_host[host].add(key)
+			self.by_domain[registrable_domain(host)].add(key)
+
+	def remove(self, key: Hashable):
+		"""Remove the host stored under given key from the index.
+		"""
+		with self.lock:
+			host = self.hosts.pop(key, None)
+			if host is None:
+				return
+			for index, name in ((self.by_host, host), (self.by_domain, registrable_domain(host))):
+				keys = index[name]
+				keys.discard(key)
+				if not keys:
+					del index[name]
+
+	def update(self, key: Hashable, url: str):
+		"""Replace the host stored under given key, e.g. after an edit.
+		"""
+		with self.lock:
+			self.remove(key)
+			self.add(key, url)
+
+	def matches(self, key: Hashable, query: str) -> bool:
+		"""Check whether the host stored under given key belongs to the same
+		site as the URL or host name in the query.
+		"""
+		host = self.hosts.get(key)
+		return host is not None and registrable_domain(host) == registrable_domain(normalize_host(query))
+
+	def search(self, query: str) -> Set[Hashable]:
+		"""Get keys of all entries for the site (i.e. registrable domain) of
+		the URL or host name in the query.
+		"""
+		with self.lock:
+			return set(self.by_domain.get(registrable_domain(normalize_host(query)), ()))
+
+	def find(self, query: str) -> List[Hashable]:
+		"""Get keys of the entries for the site of the URL or host name in the
+		query, those for exactly that host first, then the others, each sorted.
+		"""
+		host = normalize_host(query)
+		with self.lock:
+			exact = self.by_host.get(host, set())
+			return sorted(exact) + sorted(self.by_domain.get(registrable_domain(host), set()) - exact)
+
+
+def search_key(text: str) -> str:
+	"""Get normalized form of the text for searching, case-folded and without
+	accents; plain ASCII, i.e. most values, takes a fast path. (Not cached, as
+	the values include the passwords, which should not outlive the index.)
+	"""
+	if text.isascii():
+		return text.lower()
+	decomposed = unicodedata.normalize("NFKD", text)
+	return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def natural_key(text: str) -> Tuple:
+	"""Get key for sorting text in natural order, i.e. with numbers compared
+	by value, so "item 9" comes before "item 10", ignoring case and accents.
+	"""
+	parts = re.split(r"(\d+)", search_key(text))
+	parts[1::2] = map(int, parts[1::2])
+	return tuple(parts)
+
+
+def date_key(text: str) -> Tuple:
+	"""Get key for sorting dates, in ISO or some other common formats, by
+	date; other values come after all dates, sorted as text, empty ones last.
+	"""
+	text = text.strip()
+	try:
+		return 0, datetime.date.fromisoformat(text).toordinal(), ""
+	except ValueError:
+		pass
+	for fmt in DATE_FORMATS:
+		try:
+			return 0, datetime.datetime.strptime(text, fmt).toordinal(), ""
+		except ValueError:
+			pass
+	return (1, 0, search_key(text)) if text else (2, 0, "")
+
+
+def sort_key(attribute: str) -> Callable[[str], Tuple]:
+	"""Get function for getting the sort key of values of the given attribute.
+	"""
+	return SORT_KEYS.get(attribute, search_key)
+
+
+SORT_KEYS = {
+	"label": natural_key,
+	"last_changed": date_key,
+}
+
+
+def normalize_tag(tag: str) -> str:
+	return tag.strip().lower()
+
+
+def split_tags(tags: str) -> Set[str]:
+	"""Get set of normalized tags from comma-separated string, without blanks.
+	"""
+	return {normalize_tag(tag) for tag in tags.split(",")} - {""}
+
+
+def ngrams(text: str) -> Set[str]:
+	"""Get set of all n-grams of the given text, not spanning attributes.
+	"""
+	return {part[i:i+N_GRAM] for part in text.split(SEPARATOR)
+	                         for i in range(len(part) - N_GRAM + 1)}
+
+
+def test():
+	"""Just for testing that index search is the same as a linear search.
+	"""
+	from pwdmgr_model import create_test_passwords
+	pwds = create_test_passwords(100)
+	index = SearchIndex(enumerate(p.values() for p in pwds))
+	index.update(42, ["Foo", "Bar", *pwds[42].values()[2:]])
+	pwds[42].label, pwds[42].username = "Foo", "Bar"
+	for query in ("", "l", "LA", "label4", "bel42", "4", "oob", "ar", "s1\0u", "xyz"):
+		expected = {i for i, p in enumerate(pwds) if any(query.lower() in v.lower() for v in p.values())}
+		assert index.search(query) == expected, query
+	index.remove(42)
+	assert 42 not in index.search("label")
+	index.update(7, ["Straße", "Crème Brûlée", "ΣΊΣΥΦΟΣ", "ﬁle"])
+	for query in ("STRASSE", "creme brulee", "BRÛLÉE", "σίσυφος", "file"):
+		assert index.search(query) == {7} and index.matches(7, query), query
+
+	tags = TagIndex(enumerate(["work, Home", "homework", "", "home,games", " work"]))
+	assert tags.counts() == {"games": 1, "home": 2, "homework": 1, "work": 2}
+	assert tags.search(["Work"]) == {0, 4}
+	assert tags.search(["work", "home"]) == {0}
+	assert tags.search(["work", "home"], match_all=False) == {0, 3, 4}
+	assert tags.search(["unknown"]) == tags.search([]) == set()
+	tags.update(4, "games")
+	tags.remove(1)
+	assert tags.counts() == {"games": 2, "home": 2, "work": 1}
+
+	labels = ["Item 10", "item 9", "Ítem 9b", "item", "10", "9 lives", ""]
+	assert sorted(labels, key=natural_key) == ["", "9 lives", "10", "item", "item 9", "Ítem 9b", "Item 10"]
+	dates = ["2020-02-01", "", "1.2.2020", "2019", "unknown", "2020/01/15"]
+	assert sorted(dates, key=date_key) == ["2019", "2020/01/15", "2020-02-01", "1.2.2020", "unknown", ""]
+
+	hosts = HostIndex(enumerate(["https://www.example.com/a", "login.example.com:443", "",
+	                             "https://example.org", "http://mail.example.com", "no site"]))
+	assert hosts.find("https://mail.example.com/inbox") == [4, 0, 1]
+	assert hosts.search("EXAMPLE.com") == {0, 1, 4} and hosts.search("") == set()
+	assert hosts.matches(1, "example.com") and not hosts.matches(2, "example.com")
+	hosts.update(4, "example.org")
+	hosts.remove(0)
+	assert hosts.find("example.com") == [1] and hosts.find("example.org") == [3, 4]
+
+	reuse = ReuseIndex(enumerate(["a", "b", "a", "", "", "c", "a"]))
+	assert reuse.reused == {0, 2, 6} and reuse.groups() == [{0, 2, 6}]
+	reuse.update(5, "b")
+	reuse.update(0, "")
+	reuse.remove(6)
+	assert reuse.reused == {1, 5} and reuse.groups() == [{1, 5}]
+
+
+# testing stuff
+if __name__ == "__main__":
+	test()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+"""Import and export for simple Password Manager.
+
+Bulk import of passwords from CSV files (e.g. the password exports of Firefox,
+Chrome and most other password managers), KeePass 2 XML exports, or plain JSON
+in the password file's format, and export to CSV or JSON, optionally encrypted.
+
+Records are streamed through a pipeline of generators, so the file being
+imported is never held in memory as a whole, only the resulting passwords:
+parse the file into dicts, map their fields onto the ATTRIBUTES, and merge them
+into the existing passwords, using an index of label, username and URL of each
+entry; entries already present are updated, not added a second time. The
+caller then saves the passwords once. Likewise, exports are written in chunks,
+and encrypted exports streamed into GPG, without building the plain text.
+"""
+
+import csv
+import datetime
+import io
+import json
+import sys
+import time
+import urllib.parse
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+import pwdmgr_trace
+from pwdmgr_model import ATTRIBUTES, Password, iter_from_json
+
+CHUNK_ROWS = 1000        # number of rows per chunk written in exports
+PROGRESS_EVERY = 100_000  # number of records between progress reports
+MAX_FIELD = 2**24         # maximum size of a field in CSV files, e.g. long notes
+
+# lower-case names of fields in other formats, for each of the ATTRIBUTES
+FIELD_NAMES = {
+	"label": ("label", "title", "name"),
+	"username": ("username", "user name", "user", "login", "login_username"),
+	"password": ("password", "login_password"),
+	"email": ("email", "e-mail", "mail"),
+	"url": ("url", "website", "web site", "login_uri", "origin", "hostname"),
+	"notes": ("notes", "note", "comment", "comments", "extra"),
+	"tags": ("tags", "group", "folder", "grouping", "category"),
+	"last_changed": ("last_changed", "timepasswordchanged", "lastmodificationtime", "modified"),
+}
+ALIASES = {name: att for att, names in FIELD_NAMES.items() for name in names}
+
+
+def read_csv(path: str) -> Iterator[Dict[str, str]]:
+	"""Read records from CSV file with a header line, one dict per row.
+	"""
+	csv.field_size_limit(max(csv.field_size_limit(), MAX_FIELD))
+	with open(path, "r", encoding="utf-8-sig", newline="") as f:
+		yield from csv.DictReader(f)
+
+
+def read_keepass(path: str) -> Iterator[Dict[str, str]]:
+	"""Read records from KeePass 2 XML export, one dict per entry, with the
+	entry's strings (e.g. Title, UserName), its tags and the name of its group
+	(not counting the root group), and its last modification time. Entries in
+	the history of other entries are skipped, and each entry is removed from
+	the tree once read.
+	"""
+	import xml.etree.ElementTree as ET
+	elements, groups = [], []
+	for event, elem in ET.iterparse(path, events=("start", "end")):
+		if event == "start":
+			elements.append(elem)
+			if elem.tag == "Group":
+				groups.append("")
+			continue
+		elements.pop()
+		parent = elements[-1] if elements else None
+		if elem.tag == "Name" and parent is not None and parent.tag == "Group":
+			groups[-1] = elem.text or ""
+		elif elem.tag == "Group":
+			groups.pop()
+		elif elem.tag == "Entry" and parent is not None and parent.tag != "History":
+			record = {s.findtext("Key"): s.findtext("Value") or "" for s in elem.iterfind("String")}
+			tags = (elem.findtext("Tags") or "").replace(";", ",").split(",")
+			if len(groups) > 1 and groups[-1]:
+				tags.append(groups[-1])
+			record["Tags"] = ",".join(tag.strip() for tag in tags if tag.strip())
+			record["LastModificationTime"] = elem.findtext("Times/LastModificationTime") or ""
+			parent.remove(elem)
+			yield record
+
+
+def read_json(path: str) -> Iterator[Dict[str, str]]:
+	"""Read records from plain JSON file in the password file's format.
+	"""
+	with open(path, "r", encoding="utf-8") as f:
+		for pwd in iter_from_json(iter(lambda: f.read(2**16), "")):
+			yield pwd.to_dict()
+
+
+READERS: Dict[str, Callable[[str], Iterator[Dict[str, str]]]] = {
+	"csv": read_csv,
+	"xml": read_keepass,
+	"json": read_json,
+}
+
+
+def to_password(record: Dict[str, str]) -> Password:
+	"""Map fields of a record onto the ATTRIBUTES, using the first non-empty
+	field for each of them; use the URL's host name if there is no label.
+	"""
+	values = dict.fromkeys(ATTRIBUTES, "")
+	for name, value in record.items():
+		att = ALIASES.get((name or "").strip().lower())
+		if att is not None and value and not values[att]:
+			values[att] = value if att == "password" else value.strip()
+	if not values["label"] and values["url"]:
+		values["label"] = urllib.parse.urlsplit(values["url"]).hostname or values["url"]
+	values["last_changed"] = to_date(values["last_changed"])
+	return Password(**values)
+
+
+def to_date(value: str) -> str:
+	"""Get ISO date from ISO timestamp or milliseconds since the epoch (as in
+	Firefox exports), or the value itself if it is neither.
+	"""
+	if value.isdigit() and len(value) > 10:
+		return datetime.datetime.fromtimestamp(int(value) / 1000, datetime.timezone.utc).date().isoformat()
+	if len(value) > 10 and value[4:5] == "-" and value[10] in "T ":
+		return value[:10]
+	return value
+
+
+def identity(pwd: Password) -> Tuple[str, str, str]:
+	"""Get the attributes identifying an entry when merging.
+	"""
+	return pwd.label.casefold(), pwd.username, pwd.url
+
+
+def merge(passwords: List[Password], imported: Iterable[Password]) -> Tuple[List[int], List[int], int]:
+	"""Merge the imported passwords into the list of passwords: update entries
+	with the same label, username and URL with the imported non-empty values,
+	merging the tags, and add the others; get positions of added and updated
+	entries, and the number of imported entries that were already present.
+	"""
+	index = {identity(p): i for i, p in enumerate(passwords)}
+	n_old, added, updated, unchanged = len(passwords), [], set(), 0
+	for pwd in imported:
+		key = identity(pwd)
+		i = index.get(key)
+		if i is None:
+			index[key] = len(passwords)
+			added.append(len(passwords))
+			passwords.append(pwd)
+			continue
+		old = passwords[i]
+		values = {att: new or value for att, value, new in zip(ATTRIBUTES, old.values(), pwd.values())}
+		if pwd.tags and pwd.tags != old.tags:
+			values["tags"] = ",".join(dict.fromkeys(tag.strip() for tags in (old.tags, pwd.tags)
+			                                                    for tag in tags.split(",") if tag.strip()))
+		if list(values.values()) == old.values():
+			unchanged += 1
+		else:
+			for att, value in values.items():
+				setattr(old, att, value)
+			if i < n_old:
+				updated.add(i)
+	return added, sorted(updated), unchanged
+
+
+def with_progress(records: Iterable, every: int = PROGRESS_EVERY) -> Iterator:
+	"""Pass the records through, printing the number of records read so far
+	and the throughput every so many records, and at the end.
+	"""
+	start, n = time.perf_counter(), 0
+	for n, record in enumerate(records, start=1):
+		if n % every == 0:
+			report_progress(n, start)
+		yield record
+	report_progress(n, start)
+	pwdmgr_trace.count("records.imported", n)
+
+
+def report_progress(n: int, start: float):
+	seconds = time.perf_counter() - start
+	print(f"read {n} records in {seconds:.1f} s ({n / max(seconds, 1e-9):.0f} records/s)", file=sys.stderr)
+
+
+def read(path: str, fmt: str = None) -> Iterator[Password]:
+	"""Read passwords from the file in the given format (default: from the
+	file's extension), reporting progress.
+	"""
+	fmt = fmt or path.rsplit(".", 1)[-1].lower()
+	if fmt not in READERS:
+		raise ValueError(f"Unknown import format: {fmt} (known: {', '.join(READERS)})")
+	return map(to_password, with_progress(READERS[fmt](path)))
+
+
+def iter_csv(passwords: Iterable[Password]) -> Iterator[str]:
+	"""Get chunks of CSV text, with a header line with the ATTRIBUTES.
+	"""
+	buf = io.StringIO()
+	writer = csv.writer(buf)
+	writer.writerow(ATTRIBUTES)
+	for i, pwd in enumerate(passwords, start=1):
+		writer.writerow(pwd.values())
+		if i % CHUNK_ROWS == 0:
+			yield buf.getvalue()
+			buf.seek(0)
+			buf.truncate()
+	yield buf.getvalue()
+
+
+def iter_json(passwords: Iterable[Password]) -> Iterator[str]:
+	"""Get chunks of JSON text in the password file's compact format.
+	"""
+	yield "["
+	chunk = []
+	for i, pwd in enumerate(passwords):
+		chunk.append(("," if i else "") + json.dumps(pwd.to_dict(), ensure_ascii=False, separators=(",", ":")))
+		if len(chunk) == CHUNK_ROWS:
+			yield "".join(chunk)
+			chunk = []
+	yield "".join(chunk) + "]"
+
+
+WRITERS: Dict[str, Callable[[Iterable[Password]], Iterator[str]]] = {
+	"csv": iter_csv,
+	"json": iter_json,
+}
+
+
+class ChunkReader(io.RawIOBase):
+	"""Read-only file object over an iterator of text chunks, encoded as
+	UTF-8 on the fly, e.g. for streaming them into GPG.
+	"""
+
+	def __init__(self, chunks: Iterable[str]):
+		self.chunks = iter(chunks)
+		self.buf = b""
+
+	def readable(self):
+		return True
+
+	def readinto(self, b):
+		while not self.buf:
+			chunk = next(self.chunks, None)
+			if chunk is None:
+				return 0
+			self.buf = chunk.encode("utf-8")
+		n = min(len(b), len(self.buf))
+		b[:n] = self.buf[:n]
+		self.buf = self.buf[n:]
+		return n
+
+
+@pwdmgr_trace.timed()
+def export(passwords: Iterable[Password], path: str, fmt: str = "csv", usermail: str = None, session=None):
+	"""Write passwords to file in the given format, encrypted for the given
+	e-mail if any, streaming the plain text into GPG; otherwise as plain text.
+	"""
+	chunks = WRITERS[fmt](passwords)
+	if usermail is None:
+		with open(path, "w", encoding="utf-8", newline="") as f:
+			f.writelines(chunks)
+	else:
+		import pwdmgr_core
+		session = session or pwdmgr_core.get_session()
+		session.encrypt_file(io.BufferedReader(ChunkReader(chunks)), usermail, path)
+
+
+def test():
+	"""Just for testing reading, merging and writing, with temporary files.
+	"""
+	import os
+	import tempfile
+	from pwdmgr_model import create_random_passwords
+	pwds = create_random_passwords(50)
+	with tempfile.TemporaryDirectory() as tmp:
+		for fmt in WRITERS:
+			path = os.path.join(tmp, f"export.{fmt}")
+			export(pwds, path, fmt)
+			assert list(read(path)) == pwds, fmt
+
+		path = os.path.join(tmp, "firefox.csv")
+		with open(path, "w", newline="") as f:
+			f.write('"url","username","password","httpRealm","timePasswordChanged"\n'
+			        '"https://example.com/login","me","sec,ret","","1600000000000"\n')
+		merged = [Password(*p.values()) for p in pwds]
+		assert merge(merged, read(path)) == ([50], [], 0)
+		assert merged[50].values() == ["example.com", "me", "sec,ret", "", "https://example.com/login",
+		                               "", "", "2020-09-13"]
+		path = os.path.join(tmp, "chrome.csv")
+		with open(path, "w", newline="") as f:
+			csv.writer(f).writerows([["name", "url", "username", "password", "note"],
+			                         [pwds[0].label.upper(), pwds[0].url, pwds[0].username, "new", ""],
+			                         ["x", "", "", "y", ""], ["x", "", "", "y", "z"]])
+		assert merge(merged, read(path)) == ([51], [0], 0)
+		assert merged[0].password == "new" and merged[0].notes == pwds[0].notes
+		assert merged[51].notes == "z"
+		assert merge(merged, read(path)) == ([], [], 3)
+
+		path = os.path.join(tmp, "keepass.xml")
+		with open(path, "w") as f:
+			f.write("""<KeePassFile><Root><Group><Name>Root</Name>
+				<Entry><String><Key>Title</Key><Value>top</Value></String></Entry>
+				<Group><Name>Work</Name>
+					<Entry><String><Key>Title</Key><Value>mail</Value></String>
+					<String><Key>UserName</Key><Value>me</Value></String>
+					<String><Key>Password</Key><Value> x </Value></String>
+					<Tags>a;b</Tags><Times><LastModificationTime>2021-02-03T04:05:06Z</LastModificationTime></Times>
+					<History><Entry><String><Key>Title</Key><Value>old</Value></String></Entry></History>
+					</Entry>
+				</Group></Group></Root></KeePassFile>""")
+		assert [p.values() for p in read(path)] == [["top", "", "", "", "", "", "", ""],
+		                                           ["mail", "me", " x ", "", "", "", "a,b,Work", "2021-02-03"]]
+
+
+# testing stuff
+if __name__ == "__main__":
+	test()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+"""Change journal for simple Password Manager.
+
+Keeps track of passwords being added, modified and marked for deletion, by
+row ID, as those changes happen, so that the status of a row and whether there
+are any changes at all can be determined without comparing all the passwords,
+and so that changes can be undone one after the other.
+"""
+
+from typing import List, Optional, Tuple
+
+from pwdmgr_model import ATTRIBUTES, Password
+
+# status of rows that have been changed
+NEW, MODIFIED, DELETED = "new", "modified", "deleted"
+
+
+class ChangeJournal:
+	"""Journal of changes to a list of passwords. Row IDs up to the number of
+	original passwords refer to those, higher IDs to newly added rows.
+	"""
+
+	def __init__(self, passwords: List[Password]):
+		self.original = passwords
+		self.added = set()
+		self.deleted = set()
+		self.modified = {}  # row ID -> {column: value different from original}
+		self.history = []   # operations to be undone, most recent last
+
+	def add(self, row_id: int):
+		"""Record the addition of a new row.
+		"""
+		self.added.add(row_id)
+		self.history.append(("add", row_id))
+
+	def toggle_delete(self, row_id: int):
+		"""Record marking or un-marking a row for deletion.
+		"""
+		self.deleted ^= {row_id}
+		self.history.append(("delete", row_id))
+
+	def modify(self, row_id: int, column: int, old_value: str, new_value: str):
+		"""Record change of an attribute of a row from old to new value.
+		"""
+		self._set(row_id, column, new_value)
+		self.history.append(("modify", row_id, column, old_value))
+
+	def _set(self, row_id, column, value):
+		if row_id in self.added:
+			return
+		changes = self.modified.setdefault(row_id, {})
+		if value == getattr(self.original[row_id], ATTRIBUTES[column]):
+			changes.pop(column, None)
+			if not changes:
+				del self.modified[row_id]
+		else:
+			changes[column] = value
+
+	def undo(self) -> Optional[Tuple]:
+		"""Revert the last change in the journal and return it, so the caller
+		can revert it in the UI, too, or None if there is nothing to undo.
+		"""
+		if not self.history:
+			return None
+		op = self.history.pop()
+		if op[0] == "add":
+			self.added.discard(op[1])
+			self.deleted.discard(op[1])
+		elif op[0] == "delete":
+			self.deleted ^= {op[1]}
+		elif op[0] == "modify":
+			self._set(*op[1:])
+		return op
+
+	def status(self, row_id: int) -> Optional[str]:
+		"""Get status of the given row, or None if it is unchanged.
+		"""
+		return (DELETED if row_id in self.deleted
+		   else NEW if row_id in self.added
+		   else MODIFIED if row_id in self.modified
+		   else None)
+
+	def is_dirty(self) -> bool:
+		"""Check whether there are any changes that would have to be saved.
+		"""
+		n_added, n_modified, n_deleted = self.counts()
+		return n_added + n_modified + n_deleted > 0
+
+	def counts(self) -> Tuple[int, int, int]:
+		"""Get number of added, modified and deleted passwords, not counting
+		new passwords that are marked for deletion.
+		"""
+		return (len(self.added - self.deleted),
+		        len(self.modified.keys() - self.deleted),
+		        len(self.deleted - self.added))
+
+	def summary(self) -> str:
+		"""Get short human-readable summary of the changes.
+		"""
+		return "%d added, %d modified, %d deleted" % self.counts()
+
+
+def test():
+	"""Just for testing the recording and undoing of changes.
+	"""
+	from pwdmgr_model import create_test_passwords
+	journal = ChangeJournal(create_test_passwords(3))
+	assert not journal.is_dirty()
+	journal.modify(0, 0, "label0", "foo")
+	journal.add(3)
+	journal.toggle_delete(1)
+	assert [journal.status(i) for i in range(4)] == [MODIFIED, DELETED, None, NEW]
+	assert journal.summary() == "1 added, 1 modified, 1 deleted"
+	journal.modify(0, 0, "foo", "label0")
+	assert journal.status(0) is None
+	assert journal.undo() == ("modify", 0, 0, "foo")
+	assert journal.status(0) == MODIFIED
+	while journal.undo():
+		pass
+	assert not journal.is_dirty()
+
+
+# testing stuff
+if __name__ == "__main__":
+	test()
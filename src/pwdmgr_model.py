@@ -8,16 +8,30 @@ Data model for stored passwords, with attributes such as a label, username and
 password, tags, date of last change, etc.
 """
 
-from typing import List
+from operator import attrgetter, itemgetter
+from typing import Iterable, Iterator, List, Union
 import json
+import sys
+
+import pwdmgr_trace
+
+_orjson = ...  # optional, faster JSON backend; imported on first use
 
 ATTRIBUTES = "label", "username", "password", "email", "url", "notes", "tags", "last_changed"
 
 
+_get_values = attrgetter(*ATTRIBUTES)
+_get_items = itemgetter(*ATTRIBUTES)
+
+
 class Password:
-	"""Class representing a single password.
+	"""Class representing a single password. Uses slots instead of a per-instance
+	dict to keep the memory footprint of large vaults small; tags are interned,
+	as the same few tag strings are shared by many passwords.
 	"""
 
+	__slots__ = ATTRIBUTES
+
 	def __init__(self, label, username, password, email, url, notes, tags, last_changed):
 		self.label = label
 		self.username = username
@@ -25,11 +39,14 @@ class Password:
 		self.email = email
 		self.url = url
 		self.notes = notes
-		self.tags = tags
+		self.tags = sys.intern(tags) if type(tags) is str else tags
 		self.last_changed = last_changed
 
 	def values(self):
-		return [getattr(self, att) for att in ATTRIBUTES]
+		return list(_get_values(self))
+
+	def to_dict(self):
+		return dict(zip(ATTRIBUTES, _get_values(self)))
 
 	def __eq__(self, other):
 		return isinstance(other, Password) and self.values() == other.values()
@@ -40,28 +57,130 @@ class Password:
 
 
 class Configuration:
-	"""Configuration for the password manager.
+	"""Configuration for the password manager. The filter delay is the time in
+	milliseconds to wait for more keystrokes before starting to filter; in
+	append-only mode, changes are saved to a log instead of rewriting the file;
+	the JSON format is one of FORMATS, used for saving the passwords. Vaults
+	are additional password files, as dicts with "filename" and, if different
+	from the main one, "usermail", all shown together with the main file. The
+	breach list is the path of a list of hashes of breached passwords, if any.
 	"""
 
-	def __init__(self, usermail, filename):
+	def __init__(self, usermail, filename, filter_delay=250, append_only=False,
+	             json_format="pretty", vaults=(), breach_list=None):
 		self.usermail = usermail
 		self.filename = filename
+		self.filter_delay = filter_delay
+		self.append_only = append_only
+		self.json_format = json_format
+		self.vaults = list(vaults)
+		self.breach_list = breach_list
+
+	def get_vaults(self) -> List["Configuration"]:
+		"""Get configuration for each vault, i.e. the main password file and
+		the additional vaults, with the same settings otherwise.
+		"""
+		return [self] + [Configuration(v.get("usermail", self.usermail), v["filename"],
+		                               self.filter_delay, self.append_only, self.json_format)
+		                 for v in self.vaults]
 
 	def __repr__(self):
-		return "Configuration(%r, %r)" % (self.usermail, self.filename)
+		return "Configuration(%r, %r, %r, %r, %r, %r, %r)" % (self.usermail, self.filename,
+				self.filter_delay, self.append_only, self.json_format, self.vaults, self.breach_list)
 
 
-def load_from_json(json_str: str) -> List[Password]:
-	"""Load password configuration from JSON string.
+def get_orjson():
+	"""Get the orjson module, if available, or None; it is imported only when
+	first needed, as importing it takes a while.
 	"""
-	return [Password(**d) for d in json.loads(json_str)]
+	global _orjson
+	if _orjson is ...:
+		try:
+			import orjson
+			_orjson = orjson
+		except ImportError:
+			_orjson = None
+	return _orjson
 
 
-def write_to_json(passwords: List[Password]) -> str:
-	"""Store password configuration in JSON string.
+@pwdmgr_trace.timed()
+def load_from_json(json_str: Union[str, bytes]) -> List[Password]:
+	"""Load password configuration from JSON string or UTF-8 encoded bytes,
+	e.g. directly from the output of GPG, in any of the FORMATS.
 	"""
-	return json.dumps([p.__dict__ for p in passwords],
-	                  sort_keys=True, indent=4, separators=(',', ': '))
+	orjson = get_orjson()
+	loads = orjson.loads if orjson is not None else json.loads
+	# positional is faster; keywords for proper error on unknown attributes
+	return [Password(*_get_items(d)) if len(d) == len(ATTRIBUTES) else Password(**d)
+	        for d in loads(json_str)]
+
+
+def iter_from_json(chunks: Iterable[str]) -> Iterator[Password]:
+	"""Incrementally load passwords from chunks of a JSON array, yielding each
+	Password as soon as its object is complete, without holding the entire
+	string or list in memory.
+	"""
+	decoder = json.JSONDecoder()
+	buf, pos, started = "", 0, False
+	for chunk in chunks:
+		buf = buf[pos:] + chunk
+		pos = 0
+		while True:
+			while pos < len(buf) and buf[pos] in " \t\r\n,":
+				pos += 1
+			if pos == len(buf):
+				break
+			if not started:
+				if buf[pos] != "[":
+					raise ValueError(f"Expected JSON array, got {buf[pos]!r}")
+				started = True
+				pos += 1
+				continue
+			if buf[pos] == "]":
+				return
+			try:
+				d, end = decoder.raw_decode(buf, pos)
+			except json.JSONDecodeError:
+				break  # incomplete object, wait for next chunk
+			yield Password(**d)
+			pos = end
+	raise ValueError("Unexpected end of JSON array")
+
+
+@pwdmgr_trace.timed()
+def write_to_json(passwords: List[Password], fmt: str = "pretty") -> str:
+	"""Store password configuration in JSON string in one of the FORMATS.
+	"""
+	return FORMATS[fmt](passwords).decode("utf-8")
+
+
+@pwdmgr_trace.timed()
+def write_to_bytes(passwords: List[Password], fmt: str = "pretty") -> bytes:
+	"""Store password configuration as UTF-8 encoded JSON in one of the
+	FORMATS, e.g. to be passed to GPG directly, without an extra str copy.
+	"""
+	return FORMATS[fmt](passwords)
+
+
+def _write_pretty(passwords: List[Password]) -> bytes:
+	# human-readable and -repairable, with sorted keys, one line per attribute
+	return json.dumps([p.to_dict() for p in passwords],
+	                  sort_keys=True, indent=4, separators=(',', ': ')).encode("utf-8")
+
+
+def _write_compact(passwords: List[Password]) -> bytes:
+	# no whitespace, keys in order of ATTRIBUTES, using faster backend if available
+	dicts = [dict(zip(ATTRIBUTES, _get_values(p))) for p in passwords]
+	orjson = get_orjson()
+	if orjson is not None:
+		return orjson.dumps(dicts)
+	return json.dumps(dicts, ensure_ascii=False, separators=(',', ':')).encode("utf-8")
+
+
+FORMATS = {
+	"pretty": _write_pretty,
+	"compact": _write_compact,
+}
 
 
 def create_test_passwords(n: int = 5) -> List[Password]:
@@ -70,6 +189,47 @@ def create_test_passwords(n: int = 5) -> List[Password]:
 	return [Password(**{a: f"{a}{i}" for a in ATTRIBUTES}) for i in range(n)]
 
 
+# building blocks for realistic random test passwords, including non-ASCII
+SITES = ("mail", "bank", "shop", "forum", "wiki", "cloud", "news", "games", "travel",
+         "insurance", "café", "bücherei", "straße", "crème", "日本", "дом", "ελλάδα", "🔑vault")
+TAGS = ("work", "private", "finance", "shopping", "social", "email", "games", "travel",
+        "dev", "admin", "family", "old", "2fa", "shared", "ünïcödé", "重要")
+
+
+def create_random_passwords(n: int = 5, seed: int = 0) -> List[Password]:
+	"""Create realistic random passwords for testing and benchmarks, with
+	varied lengths of all attributes, some non-ASCII characters, and tags
+	following a Zipf-like distribution; the same seed gives the same passwords.
+	"""
+	import datetime
+	import random
+	import string
+	rng = random.Random(seed)
+	chars = string.ascii_letters + string.digits + string.punctuation + "äöüß€"
+	tag_weights = [1 / (i + 1) for i in range(len(TAGS))]
+	def word(lo, hi):
+		return "".join(rng.choices(string.ascii_lowercase, k=rng.randint(lo, hi)))
+	passwords = []
+	for i in range(n):
+		site = rng.choice(SITES)
+		user = word(3, 12) + (str(rng.randrange(1000)) if rng.random() < 0.3 else "")
+		domain = word(3, 15)
+		notes = "" if rng.random() < 0.6 else \
+		        " ".join(word(1, 10) for _ in range(int(rng.paretovariate(1.2) * 3)))
+		tags = {rng.choices(TAGS, tag_weights)[0] for _ in range(rng.choice((0, 1, 1, 2, 2, 3, 4)))}
+		date = datetime.date(2010, 1, 1) + datetime.timedelta(days=rng.randrange(6000))
+		passwords.append(Password(
+			label=f"{site} {domain}" + (f" {i}" if rng.random() < 0.5 else ""),
+			username=user,
+			password="".join(rng.choices(chars, k=rng.randint(8, 40))),
+			email=f"{user}@{word(4, 10)}.example",
+			url=f"https://{rng.choice(('www.', 'login.', ''))}{domain}.example/{word(0, 20)}",
+			notes=notes,
+			tags=",".join(sorted(tags)),
+			last_changed=date.isoformat()))
+	return passwords
+
+
 def create_test_config() -> Configuration:
 	"""Create dummy config for testing.
 	"""
@@ -86,6 +246,12 @@ def test():
 	print(pwds)
 	print(pwds2)
 	assert pwds == pwds2
+	pwds3 = list(iter_from_json(s[i:i+7] for i in range(0, len(s), 7)))
+	assert pwds == pwds3
+	for fmt in FORMATS:
+		assert pwds == load_from_json(write_to_bytes(pwds, fmt))
+	pwds4 = create_random_passwords(100)
+	assert pwds4 == create_random_passwords(100) == load_from_json(write_to_json(pwds4, "compact"))
 
 
 # testing stuff
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+"""Sharded vault format for simple Password Manager.
+
+Alternative file format for large password collections: The main file holds
+an encrypted index with all attributes except the secret ones (password and
+notes), which are stored in a number of separately encrypted shard files in a
+directory next to it. Only the index is decrypted when loading; shards are
+decrypted when a secret attribute of one of their passwords is first accessed,
+and only shards whose content changed are encrypted again when saving.
+
+    <filename>           encrypted JSON: {"shards": [file names], "digests":
+                         [digests], "entries": [{attribute: value, ...,
+                         "shard": number}, ...]}
+    <filename>.shards/   encrypted shard files, each a JSON list of [password,
+                         notes] for the entries of that shard, in index order
+
+Use `python3 pwdmgr_shards.py` to migrate the configured password file from
+the single-file format to the sharded format. The shards are written before
+the index, so if the migration is interrupted, the main file still holds the
+plain list of passwords; it is then loaded as such, and the migration is
+completed by the next save or by running the migration again.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+import zlib
+from typing import Dict, List
+
+from pwdmgr_model import ATTRIBUTES, Configuration, Password
+
+SECRETS = "password", "notes"
+PUBLIC = tuple(att for att in ATTRIBUTES if att not in SECRETS)
+DEFAULT_SHARDS = 16
+
+
+def _secret(slot):
+	"""Create property for a secret attribute that loads the shard on access,
+	also before setting a new value (but not the initial None).
+	"""
+	def get(self):
+		if slot.__get__(self) is None:
+			self._vault.load_shard(self._shard)
+		return slot.__get__(self)
+	def set(self, value):
+		if value is not None:
+			# load shard first, so the value is not overwritten by a later load
+			# and the shard counts as loaded, i.e. is encrypted again on save
+			self._vault.load_shard(self._shard)
+		slot.__set__(self, value)
+	return property(get, set)
+
+
+class LazyPassword(Password):
+	"""Password from a sharded vault, whose secret attributes are decrypted
+	from the respective shard on first access.
+	"""
+
+	__slots__ = "_vault", "_shard"
+
+	password = _secret(Password.password)
+	notes = _secret(Password.notes)
+
+	def __init__(self, vault, shard, **public):
+		super().__init__(password=None, notes=None, **public)
+		self._vault = vault
+		self._shard = shard
+
+
+class ShardedVault:
+	"""State of a sharded vault, i.e. the decrypted index and which shards
+	have already been decrypted, needed for lazy loading and saving.
+	"""
+
+	def __init__(self, config: Configuration, session, n_shards: int = DEFAULT_SHARDS):
+		self.config = config
+		self.session = session
+		self.files = [None] * n_shards
+		self.digests = [None] * n_shards
+		self.members = [[] for _ in range(n_shards)]
+		self.loaded = set()
+		self.lock = threading.RLock()
+
+	def load(self) -> List[Password]:
+		"""Decrypt the index and create passwords without the secrets.
+		"""
+		print("decrypting index...")
+		index = json.loads(self.session.decrypt(self.config.filename))
+		if isinstance(index, list):
+			print("migration to sharded format incomplete; loading single file")
+			return [Password(**entry) for entry in index]
+		self.files, self.digests = index["shards"], index["digests"]
+		self.members = [[] for _ in self.files]
+		self.loaded = set()
+		passwords = []
+		for entry in index["entries"]:
+			shard = entry.pop("shard")
+			p = LazyPassword(self, shard, **entry)
+			self.members[shard].append(p)
+			passwords.append(p)
+		return passwords
+
+	def load_shard(self, shard: int):
+		"""Decrypt given shard and fill in the secrets of its passwords.
+		"""
+		with self.lock:
+			if shard in self.loaded:
+				return
+			print(f"decrypting shard {shard}...")
+			secrets = json.loads(self.session.decrypt(self.shard_path(self.files[shard])))
+			for p, values in zip(self.members[shard], secrets):
+				for att, value in zip(SECRETS, values):
+					getattr(Password, att).__set__(p, value)
+			self.loaded.add(shard)
+
+	def save(self, passwords: List[Password]):
+		"""Encrypt and save passwords, re-encrypting only the index and those
+		shards whose passwords changed; old shard files are removed only after
+		the new index has been written.
+		"""
+		shards = [shard_of(p, len(self.files)) for p in passwords]
+		groups = [[] for _ in self.files]
+		for p, shard in zip(passwords, shards):
+			groups[shard].append(p)
+
+		files, digests, obsolete = list(self.files), list(self.digests), []
+		loaded = set(self.loaded)
+		for shard, group in enumerate(groups):
+			if shard not in self.loaded and files[shard] is not None and is_same(group, self.members[shard]):
+				continue  # never decrypted, and still the same passwords
+			loaded.add(shard)
+			plain = json.dumps([[getattr(p, att) for att in SECRETS] for p in group])
+			digest = hashlib.sha256(plain.encode("utf-8")).hexdigest()
+			if digest != digests[shard]:
+				print(f"encrypting shard {shard}...")
+				name = f"{shard}-{digest[:16]}.gpg"
+				os.makedirs(shard_dir(self.config), exist_ok=True)
+				write_file(self.shard_path(name), self.session.encrypt(plain, self.config.usermail))
+				if files[shard] is not None:
+					obsolete.append(files[shard])
+				files[shard], digests[shard] = name, digest
+
+		index = {"shards": files, "digests": digests,
+		         "entries": [{**{att: getattr(p, att) for att in PUBLIC}, "shard": shard}
+		                     for p, shard in zip(passwords, shards)]}
+		if os.path.isfile(self.config.filename):
+			shutil.copy(self.config.filename, self.config.filename + ".bak")
+		write_file(self.config.filename, self.session.encrypt(json.dumps(index), self.config.usermail))
+		for name in obsolete:
+			os.remove(self.shard_path(name))
+
+		# passwords are now the members of the shards; skipped ones unchanged
+		self.files, self.digests, self.members, self.loaded = files, digests, groups, loaded
+
+	def shard_path(self, name: str) -> str:
+		return os.path.join(shard_dir(self.config), name)
+
+
+def shard_of(password: Password, n_shards: int) -> int:
+	"""Get number of the shard for the given password, derived from its label.
+	"""
+	return zlib.crc32(password.label.encode("utf-8")) % n_shards
+
+
+def is_same(group: List[Password], members: List[Password]) -> bool:
+	"""Check whether two lists contain the very same passwords in same order.
+	"""
+	return len(group) == len(members) and all(a is b for a, b in zip(group, members))
+
+
+def shard_dir(config: Configuration) -> str:
+	return config.filename + ".shards"
+
+
+def is_sharded(config: Configuration) -> bool:
+	"""Check whether the password file uses the sharded format.
+	"""
+	return os.path.isdir(shard_dir(config))
+
+
+_vaults: Dict[str, ShardedVault] = {}
+
+
+def load(config: Configuration, session) -> List[Password]:
+	"""Load passwords from sharded vault, decrypting only the index for now.
+	"""
+	vault = ShardedVault(config, session)
+	passwords = vault.load()
+	_vaults[config.filename] = vault
+	return passwords
+
+
+def save(config: Configuration, session, passwords: List[Password]):
+	"""Save passwords to sharded vault, loading its index first if needed.
+	"""
+	if config.filename not in _vaults:
+		load(config, session)
+	_vaults[config.filename].save(passwords)
+
+
+def write_file(filename: str, text: str):
+	"""Write text to file atomically, via temporary file.
+	"""
+	with open(filename + ".tmp", "w") as f:
+		f.write(text)
+	os.replace(filename + ".tmp", filename)
+
+
+def migrate(config: Configuration, session, n_shards: int = DEFAULT_SHARDS):
+	"""Convert password file from single-file format to sharded format; the
+	original file is kept as backup.
+	"""
+	from pwdmgr_core import load_decrypt
+	passwords = load_decrypt(config, session)
+	if config.filename in _vaults and any(_vaults[config.filename].files):
+		raise Exception(f"{config.filename} is already sharded")
+	vault = ShardedVault(config, session, n_shards)
+	vault.save(passwords)
+	_vaults[config.filename] = vault
+	# remove shards written by an earlier, interrupted migration
+	for name in set(os.listdir(shard_dir(config))) - set(vault.files):
+		os.remove(vault.shard_path(name))
+
+
+def test():
+	"""Just for testing migration, saving shards that were never decrypted,
+	and moving passwords to another shard, using a throwaway keyring.
+	"""
+	import tempfile
+	from pwdmgr_core import TEST_MAIL, create_test_session, load_decrypt, save_encrypt
+	from pwdmgr_model import create_random_passwords
+	with tempfile.TemporaryDirectory() as home:
+		session = create_test_session(home)
+		conf = Configuration(TEST_MAIL, os.path.join(home, "test.gpg"))
+		pwds = create_random_passwords(40)
+		expected = [p.values() for p in pwds]
+		save_encrypt(conf, pwds, session)
+
+		# shard directory left by an interrupted migration
+		os.makedirs(shard_dir(conf))
+		open(os.path.join(shard_dir(conf), "0-stale.gpg"), "w").close()
+		assert [p.values() for p in load_decrypt(conf, session)] == expected
+		migrate(conf, session, 4)
+		assert "0-stale.gpg" not in os.listdir(shard_dir(conf))
+
+		# set secret without decrypting its shard first
+		_vaults.clear()
+		loaded = load(conf, session)
+		loaded[0].password = expected[0][2] = "new secret"
+		save(conf, session, loaded)
+		assert _vaults[conf.filename].loaded == {shard_of(loaded[0], 4)}
+		_vaults.clear()
+		loaded = load(conf, session)
+		assert [p.values() for p in loaded] == expected
+
+		# move password to another shard by changing its label
+		old_shard = shard_of(loaded[1], 4)
+		label = next(f"moved {i}" for i in range(100)
+		             if shard_of(Password(f"moved {i}", *expected[1][1:]), 4) != old_shard)
+		loaded[1].label = expected[1][0] = label
+		save(conf, session, loaded)
+		_vaults.clear()
+		assert [p.values() for p in load(conf, session)] == expected
+
+
+def main():
+	"""Migrate the configured password file to the sharded format
+	"""
+	import config
+	from pwdmgr_core import get_session
+	parser = argparse.ArgumentParser(description="Migrate password file to sharded format")
+	parser.add_argument("-n", "--shards", type=int, default=DEFAULT_SHARDS, dest="shards", help="Number of shards")
+	args = parser.parse_args()
+	conf = config.load_config()
+	print(f"Using {conf}")
+	migrate(conf, get_session(), args.shards)
+
+
+if __name__ == "__main__":
+	main()
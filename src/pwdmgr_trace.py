@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+"""Instrumentation for simple Password Manager.
+
+Lightweight timing of named spans (e.g. decryption, JSON parsing, filling the
+table), with a histogram of the durations per span, plus simple counters, for
+finding out where the time goes. Disabled by default; enable it by setting the
+environment variable `PWDMGR_TRACE` to the path of a report file (or `-` for
+stderr) before starting any of the scripts, e.g.
+
+    PWDMGR_TRACE=trace.jsonl python3 pwdmgr_gtk.py
+
+On exit, a report with one JSON object per line is appended to that file: one
+"run" line, then one line per span and per counter. Additionally setting
+`PWDMGR_PROFILE` to `cprofile` or `tracemalloc` also records the functions
+taking the most time (main thread only), or the lines allocating the most
+memory, respectively, and adds those to the report.
+
+The report only holds names of spans, counters and functions, and numbers;
+never any attribute values, nor the command line, which might contain those.
+When disabled, `timed` returns the function itself, and `span` and `count` do
+hardly more than checking a flag.
+"""
+
+import atexit
+import bisect
+import datetime
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Callable, Dict, List
+
+ENABLED = bool(os.environ.get("PWDMGR_TRACE"))
+PROFILE = os.environ.get("PWDMGR_PROFILE", "")  # "cprofile" or "tracemalloc"
+BUCKETS = (1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1, 10)  # upper bounds in seconds
+TOP = 20  # number of functions or lines to report when profiling
+
+
+class Histogram:
+	"""Number, total, min and max of durations of a span, and number of
+	durations per bucket (up to each of BUCKETS, and longer).
+	"""
+
+	__slots__ = "count", "total", "min", "max", "buckets"
+
+	def __init__(self):
+		self.count = 0
+		self.total = 0.0
+		self.min = float("inf")
+		self.max = 0.0
+		self.buckets = [0] * (len(BUCKETS) + 1)
+
+	def add(self, seconds: float):
+		self.count += 1
+		self.total += seconds
+		self.min = min(self.min, seconds)
+		self.max = max(self.max, seconds)
+		self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+
+	def to_dict(self) -> dict:
+		return {"count": self.count, "total_ms": self.total * 1000,
+		        "min_ms": self.min * 1000, "max_ms": self.max * 1000,
+		        "mean_ms": self.total * 1000 / self.count,
+		        "buckets": {f"<={b * 1000:g}ms": n for b, n in zip(BUCKETS, self.buckets)}
+		                   | {"more": self.buckets[-1]}}
+
+
+_histograms: Dict[str, Histogram] = defaultdict(Histogram)
+_counters: Dict[str, int] = Counter()
+_lock = threading.Lock()
+_profiler = None
+
+
+class _Span:
+	__slots__ = "name", "start"
+
+	def __init__(self, name):
+		self.name = name
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *_exc):
+		record(self.name, time.perf_counter() - self.start)
+
+
+class _NoSpan:
+	__slots__ = ()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *_exc):
+		pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name: str):
+	"""Context manager for timing the enclosed block under the given name.
+	"""
+	return _Span(name) if ENABLED else _NO_SPAN
+
+
+def timed(name: str = None) -> Callable:
+	"""Decorator for timing each call of a function under the given name,
+	or its qualified name; returns the function itself if disabled.
+	"""
+	def decorate(func):
+		if not ENABLED:
+			return func
+		label = name or func.__qualname__
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			start = time.perf_counter()
+			try:
+				return func(*args, **kwargs)
+			finally:
+				record(label, time.perf_counter() - start)
+		return wrapper
+	return decorate
+
+
+def count(name: str, n: int = 1):
+	"""Increase the counter with the given name.
+	"""
+	if ENABLED:
+		with _lock:
+			_counters[name] += n
+
+
+def record(name: str, seconds: float):
+	"""Add a duration to the histogram of the span with the given name.
+	"""
+	with _lock:
+		_histograms[name].add(seconds)
+
+
+def report() -> List[dict]:
+	"""Get the report lines for the spans and counters recorded so far, and
+	for the profiler, if any.
+	"""
+	lines = [{"type": "run", "time": datetime.datetime.now().isoformat(timespec="seconds"),
+	          "program": os.path.basename(sys.argv[0]), "pid": os.getpid(), "profile": PROFILE}]
+	with _lock:
+		lines.extend({"type": "span", "name": name, **hist.to_dict()}
+		             for name, hist in sorted(_histograms.items()))
+		lines.extend({"type": "counter", "name": name, "value": value}
+		             for name, value in sorted(_counters.items()))
+	if PROFILE == "cprofile" and _profiler is not None:
+		lines.extend(_profile_report())
+	if PROFILE == "tracemalloc":
+		lines.extend(_tracemalloc_report())
+	return lines
+
+
+def _profile_report() -> List[dict]:
+	import pstats
+	_profiler.disable()
+	stats = pstats.Stats(_profiler).stats
+	top = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:TOP]
+	return [{"type": "profile", "function": f"{os.path.basename(file)}:{line}({func})",
+	         "calls": calls, "tottime_ms": tottime * 1000, "cumtime_ms": cumtime * 1000}
+	        for (file, line, func), (_cc, calls, tottime, cumtime, _callers) in top]
+
+
+def _tracemalloc_report() -> List[dict]:
+	import tracemalloc
+	current, peak = tracemalloc.get_traced_memory()
+	top = tracemalloc.take_snapshot().statistics("lineno")[:TOP]
+	return [{"type": "memory", "current": current, "peak": peak},
+	        *({"type": "alloc", "where": f"{os.path.basename(stat.traceback[0].filename)}:"
+	                                      f"{stat.traceback[0].lineno}",
+	           "size": stat.size, "count": stat.count} for stat in top)]
+
+
+def write_report():
+	"""Append the report to the file given in PWDMGR_TRACE, or to stderr.
+	"""
+	path = os.environ.get("PWDMGR_TRACE")
+	text = "".join(json.dumps(line) + "\n" for line in report())
+	if path == "-":
+		sys.stderr.write(text)
+	else:
+		with open(path, "a") as f:
+			f.write(text)
+
+
+def _start():
+	global _profiler
+	if PROFILE == "cprofile":
+		import cProfile
+		_profiler = cProfile.Profile()
+		_profiler.enable()
+	elif PROFILE == "tracemalloc":
+		import tracemalloc
+		tracemalloc.start()
+	atexit.register(write_report)
+
+
+if ENABLED:
+	_start()
+
+
+def test():
+	"""Just for testing the recording and reporting, regardless of ENABLED.
+	"""
+	record("test", 0.002)
+	record("test", 0.5)
+	with _Span("test"):
+		pass
+	lines = {line["name"]: line for line in report() if line["type"] == "span"}
+	assert lines["test"]["count"] == 3
+	assert lines["test"]["buckets"]["<=10ms"] == 1 and lines["test"]["buckets"]["<=1000ms"] == 1
+	print(json.dumps(lines["test"]))
+
+
+# testing stuff
+if __name__ == "__main__":
+	test()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+"""URL normalization for simple Password Manager.
+
+Helper functions for getting the host name from the free-form URL attribute of
+the passwords, ignoring scheme, user, port, path, and a leading "www.", and
+the registrable domain of a host, i.e. the part directly below its public
+suffix, e.g. "example.co.uk" for "login.example.co.uk", so that passwords can
+be found for any host of the same site.
+
+The public suffixes are read from the Public Suffix List (publicsuffix.org) if
+installed in one of the usual places (e.g. by the `publicsuffix` package on
+Debian and Ubuntu); otherwise, a small built-in list of the most common
+suffixes with more than one label is used, besides the top-level domains.
+"""
+
+import functools
+import urllib.parse
+from typing import Set, Tuple
+
+PUBLIC_SUFFIX_FILES = ("/usr/share/publicsuffix/public_suffix_list.dat",
+                       "/usr/share/publicsuffix/effective_tld_names.dat")
+
+# common public suffixes with more than one label; single labels are implied
+BUILTIN_SUFFIXES = """
+	co.uk org.uk me.uk ltd.uk plc.uk net.uk ac.uk gov.uk sch.uk nhs.uk
+	com.au net.au org.au edu.au gov.au id.au co.nz net.nz org.nz govt.nz
+	co.jp ne.jp or.jp ac.jp go.jp co.kr or.kr com.cn net.cn org.cn gov.cn
+	com.hk com.tw com.sg com.my co.id co.in net.in org.in co.il co.za org.za
+	com.br net.br org.br com.ar com.mx com.tr com.ua com.pl co.at or.at
+	github.io gitlab.io blogspot.com appspot.com herokuapp.com netlify.app
+	vercel.app pages.dev azurewebsites.net cloudfront.net s3.amazonaws.com
+"""
+
+_rules = None
+
+
+def load_rules(path: str) -> Tuple[Set[str], Set[str], Set[str]]:
+	"""Load the normal, wildcard ("*.") and exception ("!") rules from a file
+	in the format of the Public Suffix List.
+	"""
+	rules, wildcards, exceptions = set(), set(), set()
+	with open(path, "r", encoding="utf-8") as f:
+		for line in f:
+			rule = line.split(maxsplit=1)[0].lower() if line.strip() else ""
+			if not rule or rule.startswith("//"):
+				continue
+			if rule.startswith("!"):
+				exceptions.add(rule[1:])
+			elif rule.startswith("*."):
+				wildcards.add(rule[2:])
+			else:
+				rules.add(rule)
+	return rules, wildcards, exceptions
+
+
+def get_rules() -> Tuple[Set[str], Set[str], Set[str]]:
+	"""Get the public suffix rules from the first list found, or the built-in
+	rules; loaded on first use only.
+	"""
+	global _rules
+	if _rules is None:
+		for path in PUBLIC_SUFFIX_FILES:
+			try:
+				_rules = load_rules(path)
+				break
+			except OSError:
+				pass
+		else:
+			_rules = set(BUILTIN_SUFFIXES.split()), set(), set()
+	return _rules
+
+
+def normalize_host(url: str) -> str:
+	"""Get the lower-case host name of the URL, or of a host name with or
+	without path, without "www."; or an empty string if there is none.
+	"""
+	text = url.strip()
+	if not text:
+		return ""
+	if "://" not in text:
+		text = "//" + text
+	try:
+		host = urllib.parse.urlsplit(text).hostname or ""
+	except ValueError:
+		return ""
+	host = host.rstrip(".")
+	if "xn--" in host:
+		try:
+			host = host.encode("ascii").decode("idna")
+		except UnicodeError:
+			pass
+	return host[4:] if host.startswith("www.") else host
+
+
+@functools.lru_cache(maxsize=2**12)
+def registrable_domain(host: str) -> str:
+	"""Get the registrable domain of the (normalized) host name, i.e. its
+	public suffix plus one more label, or the host itself if it is an IP
+	address, a single label (e.g. "localhost"), or a public suffix.
+	"""
+	if not host or is_ip_address(host):
+		return host
+	labels = host.split(".")
+	rules, wildcards, exceptions = get_rules()
+	n = 1  # number of labels of the public suffix, by default just the TLD
+	for i in range(len(labels)):
+		suffix = ".".join(labels[i:])
+		if suffix in exceptions:
+			n = len(labels) - i - 1
+			break
+		if suffix in rules or ".".join(labels[i + 1:]) in wildcards:
+			n = len(labels) - i
+			break
+	return host if n >= len(labels) else ".".join(labels[-n - 1:])
+
+
+def is_ip_address(host: str) -> bool:
+	import ipaddress
+	try:
+		ipaddress.ip_address(host)
+		return True
+	except ValueError:
+		return False
+
+
+def test():
+	"""Just for testing normalizing host names and finding their domains,
+	with the built-in rules as well as some rules of the full list.
+	"""
+	global _rules
+	for url, host in [("https://User@WWW.Example.com:8443/login?x=1", "example.com"),
+	                  ("example.com/path", "example.com"), ("  ", ""), ("http://[::1]:80/", "::1"),
+	                  ("Mail.Example.CO.UK.", "mail.example.co.uk"), ("http://[invalid/", ""),
+	                  ("xn--bcher-kva.example", "bücher.example"), ("GitHub", "github")]:
+		assert normalize_host(url) == host, url
+	saved, _rules = _rules, (set(BUILTIN_SUFFIXES.split()), set(), set())
+	try:
+		for host, domain in [("login.example.co.uk", "example.co.uk"), ("a.b.example.com", "example.com"),
+		                     ("example.com", "example.com"), ("co.uk", "co.uk"), ("localhost", "localhost"),
+		                     ("192.168.0.1", "192.168.0.1"), ("user.github.io", "user.github.io")]:
+			assert registrable_domain(host) == domain, host
+		registrable_domain.cache_clear()
+		_rules = {"com", "ck"}, {"ck"}, {"www.ck"}
+		assert registrable_domain("a.b.foo.ck") == "b.foo.ck"
+		assert registrable_domain("a.www.ck") == "www.ck"
+	finally:
+		_rules = saved
+		registrable_domain.cache_clear()
+
+
+# testing stuff
+if __name__ == "__main__":
+	test()